@@ -0,0 +1,33 @@
+"""
+Shared setup for the scripts in benchmarks/: puts the repository root on
+sys.path, makes it the working directory and fills in the settings
+config.py requires, so bot modules import without a .env. Call setup()
+before importing any of them:
+
+    from _env import setup
+
+    setup()
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# placeholders for config.py's required settings; nothing here reaches the
+# real services
+DEFAULTS = {
+    "TOKEN": "123456:bench",
+    "DB_NAME": "bench",
+    "DB_HOST": "bench",
+    "DB_USERNAME": "bench",
+    "DB_PASSWORD": "bench",
+    "OWM_TOKEN": "bench",
+}
+
+
+def setup():
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    for name, value in DEFAULTS.items():
+        os.environ.setdefault(name, value)
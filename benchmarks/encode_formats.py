@@ -0,0 +1,47 @@
+"""
+Size and encode time of a 7-day forecast strip for every ENCODERS format.
+
+    python benchmarks/encode_formats.py --repeat 5
+"""
+
+import argparse
+import time
+
+from _env import setup
+
+setup()
+
+from bot_utils import concat_images  # noqa: E402
+from render_utils import ENCODERS, draw_card, encode_image  # noqa: E402
+
+BG_COLOR = (134, 185, 224)
+ICONS = ["sunny", "partlycloudy", "cloudy", "chancerain", "snow", "sleet", "fogorhazy"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    strip = concat_images(
+        [
+            draw_card(icon, "2026-10-{:02d}".format(i + 1), str(i) + " C")
+            for i, icon in enumerate(ICONS)
+        ],
+        bg_color=BG_COLOR,
+    )
+    print("strip {}x{}".format(*strip.size))
+    for fmt in list(ENCODERS) + ["auto"]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            data, ext = encode_image(strip, fmt)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        print(
+            "{:<14} {:>8} bytes  {:7.1f} ms  .{}".format(
+                fmt, len(data), elapsed * 1000, ext
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Event-loop lag under concurrent forecast renders, with image work run
+inline on the loop versus through worker_utils.image_pool.
+
+    python benchmarks/event_loop_lag.py --requests 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from _env import setup
+
+setup()
+
+from bot_utils import compose_strip  # noqa: E402
+from render_utils import draw_card_png  # noqa: E402
+from worker_utils import WorkerPool  # noqa: E402
+
+BG_COLOR = (134, 185, 224)
+ICONS = ["sunny", "partlycloudy", "cloudy", "chancerain", "snow", "sleet", "fogorhazy"]
+
+
+def forecast(day_offset: int) -> bytes:
+    pngs = [
+        draw_card_png(icon, "2026-10-{:02d}".format(day_offset + i), str(i) + " C")
+        for i, icon in enumerate(ICONS)
+    ]
+    return compose_strip(pngs, BG_COLOR)
+
+
+async def measure_lag(work, interval=0.001):
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - start - interval)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    start = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await task
+    return elapsed, lags
+
+
+async def run(requests: int, kind: str, workers: int):
+    async def inline():
+        async def one(i):
+            await asyncio.sleep(0)
+            forecast(i % 20)
+
+        await asyncio.gather(*(one(i) for i in range(requests)))
+
+    pool = WorkerPool(kind, workers, queue_size=requests)
+
+    async def pooled():
+        await asyncio.gather(*(pool.run(forecast, i % 20) for i in range(requests)))
+
+    for name, work in (("inline", inline), ("pool:" + kind, pooled)):
+        elapsed, lags = await measure_lag(work)
+        lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+        print(
+            "{:<14} total {:7.1f} ms  lag p50 {:6.2f} ms  p99 {:7.2f} ms  "
+            "max {:7.2f} ms".format(
+                name,
+                elapsed * 1000,
+                statistics.median(lags_ms),
+                lags_ms[int(len(lags_ms) * 0.99) - 1 if len(lags_ms) > 1 else 0],
+                lags_ms[-1],
+            )
+        )
+    pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--kind", choices=("thread", "process"), default="thread")
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.kind, args.workers))
+
+
+if __name__ == "__main__":
+    main()
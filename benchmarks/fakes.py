@@ -0,0 +1,198 @@
+"""
+Local aiohttp stand-ins for the Telegram Bot API, OpenWeatherMap and HCTI,
+serving the payloads in benchmarks/fixtures with injectable latency and
+errors. Used by benchmarks/loadtest.py.
+"""
+
+import asyncio
+import copy
+import hashlib
+import itertools
+import json
+import os
+import random
+from collections import Counter
+from io import BytesIO
+
+from aiohttp import web
+from PIL import Image
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+CITIES = {
+    "kyiv": ("Kyiv", 50.4501, 30.5234),
+    "lviv": ("Lviv", 49.8397, 24.0297),
+    "london": ("London", 51.5085, -0.1257),
+    "paris": ("Paris", 48.8534, 2.3488),
+    "berlin": ("Berlin", 52.5244, 13.4105),
+    "madrid": ("Madrid", 40.4165, -3.7026),
+    "new york": ("New York", 40.7143, -74.006),
+    "tokyo": ("Tokyo", 35.6895, 139.6917),
+    "sydney": ("Sydney", -33.8679, 151.2073),
+    "cairo": ("Cairo", 30.0626, 31.2497),
+}
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURES, name)) as file:
+        return json.load(file)
+
+
+class Upstream:
+    """
+    Base for a fake server: counts calls per route and injects latency
+    (uniform in latency +- jitter seconds) and HTTP 500s at error_rate.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.errors = Counter()
+        self.app = web.Application(middlewares=[self._inject])
+        self.runner = None
+        self.url = None
+
+    def route(self, request: web.Request) -> str:
+        return request.match_info.route.resource.canonical
+
+    @web.middleware
+    async def _inject(self, request: web.Request, handler):
+        route = self.route(request)
+        self.calls[route] += 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors[route] += 1
+            return web.json_response({"error": "injected"}, status=500)
+        return await handler(request)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = "http://{}:{}".format(host, port)
+        return self.url
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+def _city_by_coords(lat: float, lon: float):
+    return min(
+        CITIES.values(), key=lambda city: (city[1] - lat) ** 2 + (city[2] - lon) ** 2
+    )
+
+
+class FakeOwm(Upstream):
+    """
+    /data/2.5/weather, /onecall and /find. Coordinates and names are taken
+    from the request (or CITIES), and onecall honours exclude so payload
+    sizes match what the real API would send.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.weather = load_fixture("owm_weather.json")
+        self.onecall = load_fixture("owm_onecall.json")
+        self.find = load_fixture("owm_find.json")
+        self.app.router.add_get("/data/2.5/weather", self.handle_weather)
+        self.app.router.add_get("/data/2.5/onecall", self.handle_onecall)
+        self.app.router.add_get("/data/2.5/find", self.handle_find)
+
+    async def handle_weather(self, request: web.Request):
+        lat, lon = float(request.query["lat"]), float(request.query["lon"])
+        payload = copy.deepcopy(self.weather)
+        payload["coord"] = {"lat": lat, "lon": lon}
+        payload["name"] = _city_by_coords(lat, lon)[0]
+        return web.json_response(payload)
+
+    async def handle_onecall(self, request: web.Request):
+        exclude = set(request.query.get("exclude", "").split(","))
+        payload = {k: v for k, v in self.onecall.items() if k not in exclude}
+        payload["lat"] = float(request.query["lat"])
+        payload["lon"] = float(request.query["lon"])
+        return web.json_response(payload)
+
+    async def handle_find(self, request: web.Request):
+        city = CITIES.get(request.query["q"].strip().lower())
+        if city is None:
+            return web.json_response({"message": "like", "cod": "200", "list": []})
+        payload = copy.deepcopy(self.find)
+        found = payload["list"][0]
+        found["name"], found["coord"]["lat"], found["coord"]["lon"] = city
+        return web.json_response(payload)
+
+
+class FakeHcti(Upstream):
+    """
+    POST /v1/image returns a URL on this server; GET /img/<id>.png serves a
+    card-sized PNG for it.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        bio = BytesIO()
+        Image.new("RGB", (240, 300), color=(134, 185, 224)).save(bio, "PNG")
+        self.png = bio.getvalue()
+        self.app.router.add_post("/v1/image", self.handle_render)
+        self.app.router.add_get("/img/{id}.png", self.handle_image)
+
+    async def handle_render(self, request: web.Request):
+        data = await request.post()
+        image_id = hashlib.sha1(data.get("html", "").encode("utf-8")).hexdigest()
+        return web.json_response({"url": "{}/img/{}.png".format(self.url, image_id)})
+
+    async def handle_image(self, request: web.Request):
+        return web.Response(body=self.png, content_type="image/png")
+
+
+class FakeTelegram(Upstream):
+    """
+    Answers Bot API methods under /bot<token>/<method> with minimal valid
+    results. Uploaded photos get a file_id derived from their content.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.message_ids = itertools.count(1_000_000)
+        self.uploaded_bytes = 0
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    def route(self, request: web.Request) -> str:
+        return request.match_info.get("method", "?")
+
+    def _message(self, chat_id, **fields):
+        return {
+            "message_id": next(self.message_ids),
+            "date": 0,
+            "chat": {"id": int(chat_id), "type": "private"},
+            **fields,
+        }
+
+    async def handle(self, request: web.Request):
+        method = request.match_info["method"]
+        data = await request.post()
+        chat_id = data.get("chat_id", 0)
+        if method == "sendPhoto":
+            photo = data["photo"]
+            if isinstance(photo, web.FileField):
+                content = photo.file.read()
+                self.uploaded_bytes += len(content)
+                file_id = hashlib.sha1(content).hexdigest()
+            else:
+                file_id = photo
+            size = {"file_id": file_id, "file_unique_id": file_id[:16]}
+            result = self._message(
+                chat_id, photo=[dict(size, width=240, height=300, file_size=0)]
+            )
+        elif method in ("sendMessage", "editMessageText", "editMessageCaption"):
+            result = self._message(chat_id, text=data.get("text", ""))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
@@ -0,0 +1,191 @@
+"""
+Checks PostgresStorage against an in-memory stand-in for the asyncpg pool
+that interprets its few statements, so the FSM storage can be verified
+without a database. Exits 1 on a failure.
+
+    python benchmarks/fsm_storage.py
+"""
+
+import asyncio
+import json
+import sys
+
+from _env import setup
+
+setup()
+
+from aiogram.dispatcher import FSMContext  # noqa: E402
+
+from storage_utils import PostgresStorage  # noqa: E402
+
+TTL = 60
+
+
+class FakePool:
+    """
+    The fsm_states table as a dict of (chat, user) -> row, with a clock that
+    is moved by hand instead of now().
+    """
+
+    def __init__(self):
+        self.rows = {}
+        self.now = 0.0
+        self.queries = {"select": 0, "upsert": 0, "purge": 0}
+
+    def _fresh(self, row, ttl):
+        return ttl is None or row["updated_at"] >= self.now - ttl
+
+    async def fetchrow(self, query: str, chat: int, user: int, ttl):
+        assert query.startswith("SELECT state, data, bucket FROM fsm_states"), query
+        self.queries["select"] += 1
+        row = self.rows.get((chat, user))
+        if row is None or not self._fresh(row, ttl):
+            return None
+        # asyncpg returns jsonb columns as text
+        return {
+            "state": row["state"],
+            "data": json.dumps(row["data"]),
+            "bucket": json.dumps(row["bucket"]),
+        }
+
+    async def execute(self, query: str, *args):
+        if query.startswith("DELETE FROM fsm_states"):
+            self.queries["purge"] += 1
+            (ttl,) = args
+            self.rows = {
+                address: row
+                for address, row in self.rows.items()
+                if self._fresh(row, ttl)
+            }
+        elif query.startswith("INSERT INTO fsm_states"):
+            assert "ON CONFLICT" in query, query
+            self.queries["upsert"] += 1
+            chat, user, state, data, bucket = args
+            self.rows[(chat, user)] = {
+                "state": state,
+                "data": json.loads(data),
+                "bucket": json.loads(bucket),
+                "updated_at": self.now,
+            }
+        else:
+            raise AssertionError("unexpected statement: " + query)
+
+
+class FakeDatabase:
+    def __init__(self, pool: FakePool):
+        self.pool = pool
+
+
+async def in_task(coro):
+    # the storage reuses a row only within one task, i.e. one update
+    return await asyncio.create_task(coro)
+
+
+async def check() -> list:
+    failures = []
+
+    def expect(name, actual, expected):
+        if actual != expected:
+            failures.append("{}: {!r} != {!r}".format(name, actual, expected))
+
+    pool = FakePool()
+    storage = PostgresStorage(FakeDatabase(pool), ttl=TTL)
+    storage.start()
+    await asyncio.sleep(0)
+    expect("start purges right away", pool.queries["purge"], 1)
+
+    async def fresh_state():
+        return await storage.get_state(chat=1, user=1)
+
+    expect("no state yet", await in_task(fresh_state()), None)
+
+    async def set_city():
+        await storage.set_state(chat=1, user=1, state="CityForm:city")
+        await storage.update_data(chat=1, user=1, data={"city": "Kyiv"})
+
+    await in_task(set_city())
+    expect("row written", pool.rows[(1, 1)]["state"], "CityForm:city")
+
+    async def read_all():
+        before = pool.queries["select"]
+        state = await storage.get_state(chat=1, user=1)
+        data = await storage.get_data(chat=1, user=1)
+        bucket = await storage.get_bucket(chat=1, user=1)
+        return state, data, bucket, pool.queries["select"] - before
+
+    state, data, bucket, selects = await in_task(read_all())
+    expect("state read back", state, "CityForm:city")
+    expect("data read back", data, {"city": "Kyiv"})
+    expect("empty bucket", bucket, {})
+    expect("one SELECT per update", selects, 1)
+
+    async def handler_flow():
+        # what the bot's handlers do: proxy the data, then finish
+        state = FSMContext(storage, chat=1, user=1)
+        async with state.proxy() as data:
+            data["location"] = {"lat": "50.45", "lon": "30.52"}
+        await state.finish()
+
+    await in_task(handler_flow())
+    expect("finish resets state", pool.rows[(1, 1)]["state"], None)
+    expect("finish clears data", pool.rows[(1, 1)]["data"], {})
+
+    async def keep_data():
+        await storage.set_data(chat=2, user=2, data={"a": 1})
+        await storage.set_bucket(chat=2, user=2, bucket={"hits": 1})
+        await storage.update_bucket(chat=2, user=2, hits=2)
+        await storage.reset_state(chat=2, user=2, with_data=False)
+
+    await in_task(keep_data())
+    expect("reset without data", pool.rows[(2, 2)]["data"], {"a": 1})
+    expect("bucket updated", pool.rows[(2, 2)]["bucket"], {"hits": 2})
+
+    async def chat_only():
+        await storage.set_state(chat=3, state="ForecastCityForm:city")
+
+    await in_task(chat_only())
+    expect("user defaults to chat", pool.rows[(3, 3)]["state"], "ForecastCityForm:city")
+
+    # another process sharing the table sees the same rows
+    other = PostgresStorage(FakeDatabase(pool), ttl=TTL)
+    expect(
+        "shared between processes",
+        await in_task(other.get_data(chat=2, user=2)),
+        {"a": 1},
+    )
+
+    async def stale_after_write():
+        # a row cached by this task must follow its own writes
+        await storage.get_state(chat=4, user=4)
+        await storage.set_state(chat=4, user=4, state="LocationForm:location")
+        return await storage.get_state(chat=4, user=4)
+
+    expect(
+        "reads follow writes in one task",
+        await in_task(stale_after_write()),
+        "LocationForm:location",
+    )
+
+    pool.now += TTL + 1
+    expect(
+        "abandoned state expires",
+        await in_task(storage.get_state(chat=2, user=2)),
+        None,
+    )
+    await storage.purge()
+    expect("purge deletes abandoned rows", pool.rows, {})
+    await storage.close()
+    expect("close stops the purge task", storage._task, None)
+    return failures
+
+
+def main():
+    failures = asyncio.run(check())
+    if failures:
+        print("\n".join(["FAILED:"] + failures))
+        sys.exit(1)
+    print("PostgresStorage: all checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Offline load test: replays synthetic user sessions through the bot's
+Dispatcher against local stand-ins for Telegram, OWM and HCTI
+(benchmarks/fakes.py) and reports throughput, per-handler latency
+percentiles and upstream call counts.
+
+    python benchmarks/loadtest.py --users 50 --sessions 20
+    python benchmarks/loadtest.py --backend hcti --latency 0.05 --errors 0.01
+
+The database is an in-memory stand-in unless --db postgres is given, in
+which case the DB_* settings are used as usual.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import time
+from collections import Counter, defaultdict
+
+from _env import setup
+
+setup()
+
+from fakes import CITIES, FakeHcti, FakeOwm, FakeTelegram  # noqa: E402
+
+
+class MemoryDatabase:
+    """
+    Just enough of db_utils.Database for the handlers, kept in a dict.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        from cache_utils import LRUCache
+
+        self.latency = latency
+        self.users = {}
+        self.cities = {}
+        self.runs = {}
+        self.user_cache = LRUCache()
+
+    async def _wait(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _user(self, id: int):
+        return self.users.setdefault(
+            id, {"metric": "celsius", "location": None, "subscribed": False}
+        )
+
+    async def connect(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def applied_migrations(self):
+        from migrate import MIGRATIONS
+
+        return {name for name, _ in MIGRATIONS}
+
+    async def upsert_user(self, id: int):
+        await self._wait()
+        self._user(id)
+
+    async def get_user_settings(self, id: int):
+        await self._wait()
+        return dict(self._user(id))
+
+    async def get_user_location(self, id: int):
+        return (await self.get_user_settings(id))["location"]
+
+    async def get_user_metric(self, id: int):
+        return (await self.get_user_settings(id))["metric"]
+
+    async def set_user_location(self, id: int, location: dict):
+        await self._wait()
+        self._user(id)["location"] = json.dumps(location)
+
+    async def set_location_if_absent(self, id: int, location: dict):
+        await self._wait()
+        user = self._user(id)
+        if user["location"] is None:
+            user["location"] = json.dumps(location)
+            return True
+        return False
+
+    async def toggle_metric(self, id: int):
+        await self._wait()
+        user = self._user(id)
+        user["metric"] = "fahrenheit" if user["metric"] == "celsius" else "celsius"
+        return user["metric"]
+
+    async def select_saved_locations(self):
+        await self._wait()
+        locations = {u["location"] for u in self.users.values() if u["location"]}
+        return [{"location": location} for location in locations]
+
+    async def toggle_subscription(self, id: int):
+        await self._wait()
+        user = self._user(id)
+        user["subscribed"] = not user["subscribed"]
+        return user["subscribed"]
+
+    async def unsubscribe(self, id: int):
+        await self._wait()
+        self._user(id)["subscribed"] = False
+
+    async def claim_run(self, name: str, period):
+        if self.runs.get(name) is not None and self.runs[name] >= period:
+            return False
+        self.runs[name] = period
+        return True
+
+    async def select_all_cities(self):
+        return [{"query": q, **city} for q, city in self.cities.items()]
+
+    async def get_city(self, query: str):
+        await self._wait()
+        return self.cities.get(query)
+
+    async def add_city(self, query: str, name: str, lat: float, lon: float):
+        await self._wait()
+        self.cities.setdefault(query, {"name": name, "lat": lat, "lon": lon})
+
+
+class Driver:
+    """
+    Builds Telegram updates for one virtual user and feeds them to the
+    Dispatcher, timing each update under the name of the handler it targets.
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, bot_module, chat_id: int, results):
+        self.bot = bot_module
+        self.chat_id = chat_id
+        self.results = results
+        self.city = random.choice(list(CITIES.values()))
+
+    def _user(self):
+        return {"id": self.chat_id, "is_bot": False, "first_name": "Load"}
+
+    def _message(self, **fields):
+        return {
+            "message_id": next(self.ids),
+            "date": int(time.time()),
+            "chat": {"id": self.chat_id, "type": "private"},
+            "from": self._user(),
+            **fields,
+        }
+
+    async def _send(self, handler: str, **update):
+        from aiogram import types
+
+        update = types.Update(update_id=next(self.ids), **update)
+        start = time.perf_counter()
+        try:
+            # a task per update, as in polling; aiogram caches state in contextvars
+            await asyncio.create_task(self.bot.dp.process_update(update))
+        except Exception as e:
+            self.results.errors[handler] += 1
+            logging.debug("%s failed: %r", handler, e)
+        self.results.latencies[handler].append(time.perf_counter() - start)
+
+    async def text(self, handler: str, text: str):
+        await self._send(handler, message=self._message(text=text))
+
+    async def location(self, handler: str):
+        _, lat, lon = self.city
+        await self._send(
+            handler,
+            message=self._message(location={"latitude": lat, "longitude": lon}),
+        )
+
+    async def callback(self, handler: str, data: str):
+        await self._send(
+            handler,
+            callback_query={
+                "id": str(next(self.ids)),
+                "from": self._user(),
+                "chat_instance": "load",
+                "message": self._message(text="Choose option"),
+                "data": data,
+            },
+        )
+
+    def _coords(self):
+        _, lat, lon = self.city
+        return "lon_{}_lat_{}".format(lon, lat)
+
+    async def session(self):
+        """
+        One of the flows a real user goes through, picked at random.
+        """
+        from bot_utils import details_cb, metric_cb
+
+        name, lat, lon = self.city
+        flow = random.choices(
+            ["current", "details", "forecast", "city", "location", "settings"],
+            weights=[30, 15, 25, 10, 10, 10],
+        )[0]
+        if flow == "current":
+            await self.text("current_weather", "Current weather")
+            await self.callback(
+                "current_weather_location", "current_weather_location_" + self._coords()
+            )
+        elif flow == "details":
+            await self.callback(
+                "weather_details", details_cb.new(city=name, lat=lat, lon=lon)
+            )
+        elif flow == "forecast":
+            await self.text("weather_forecast", "Weather forecast")
+            await self.callback(
+                "forecast_location", "forecast_location_" + self._coords()
+            )
+        elif flow == "city":
+            await self.callback("current_weather_city", "current_weather_city")
+            await self.text("process_city", name)
+        elif flow == "location":
+            await self.callback("current_weather_location", "current_weather_location")
+            await self.location("process_geo")
+        else:
+            await self.text("settings", "Settings")
+            await self.callback(
+                "change_metric",
+                metric_cb.new(city=name, lat=lat, lon=lon, metric="celsius"),
+            )
+
+
+class Results:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+
+
+def percentiles(values):
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return value, value, value
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+def report(results: Results, elapsed: float, upstreams: dict):
+    total = sum(len(v) for v in results.latencies.values())
+    print(
+        "\n{} updates in {:.2f} s: {:.1f} updates/s".format(
+            total, elapsed, total / elapsed
+        )
+    )
+    print(
+        "\n{:<26} {:>7} {:>7} {:>9} {:>9} {:>9}".format(
+            "handler", "count", "errors", "p50 ms", "p95 ms", "p99 ms"
+        )
+    )
+    for handler, values in sorted(results.latencies.items()):
+        p50, p95, p99 = percentiles(values)
+        print(
+            "{:<26} {:>7} {:>7} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+                handler,
+                len(values),
+                results.errors[handler],
+                p50 * 1000,
+                p95 * 1000,
+                p99 * 1000,
+            )
+        )
+    print("\n{:<14} {:<26} {:>7} {:>7}".format("upstream", "route", "calls", "errors"))
+    for name, server in upstreams.items():
+        for route, calls in sorted(server.calls.items()):
+            print(
+                "{:<14} {:<26} {:>7} {:>7}".format(
+                    name, route, calls, server.errors[route]
+                )
+            )
+
+
+async def run(args):
+    fault = dict(latency=args.latency, jitter=args.jitter, error_rate=args.errors)
+    upstreams = {
+        "telegram": FakeTelegram(latency=args.telegram_latency),
+        "owm": FakeOwm(**fault),
+        "hcti": FakeHcti(**fault),
+    }
+    for server in upstreams.values():
+        await server.start()
+
+    # settings are read at import time, so the bot is imported only now
+    os.environ.update(
+        TOKEN="123456:loadtest",
+        OWM_TOKEN="loadtest",
+        OWM_API_BASE=upstreams["owm"].url,
+        TELEGRAM_API_BASE=upstreams["telegram"].url,
+        HCTI_API_ENDPOINT=upstreams["hcti"].url + "/v1/image",
+        RENDER_BACKEND=args.backend,
+        CARD_CACHE_DIR="",
+        WARMER_INTERVAL="0",
+        BROADCAST_TIME="",
+        METRICS_PORT="0",
+        BOT_MODE="polling",
+    )
+    if not args.throttle:
+        os.environ.setdefault("THROTTLE_RATE", "1000000")
+
+    import bot as bot_module
+    from aiogram import Bot, Dispatcher
+
+    # injected errors would otherwise flood the report with tracebacks
+    logging.getLogger().setLevel(logging.WARNING if args.verbose else logging.CRITICAL)
+    if args.db == "memory":
+        db = MemoryDatabase(latency=args.db_latency)
+        bot_module.db = db
+        bot_module.geocoder.db = db
+        bot_module.warmer.db = db
+    Bot.set_current(bot_module.bot)
+    Dispatcher.set_current(bot_module.dp)
+    await bot_module.on_startup(bot_module.dp)
+
+    results = Results()
+    users = [
+        Driver(bot_module, chat_id, results)
+        for chat_id in range(10_000, 10_000 + args.users)
+    ]
+
+    async def user_loop(driver: Driver):
+        for _ in range(args.sessions):
+            await driver.session()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user_loop(driver) for driver in users))
+    elapsed = time.perf_counter() - start
+
+    await bot_module.on_shutdown(bot_module.dp)
+    await (await bot_module.bot.get_session()).close()
+    for server in upstreams.values():
+        await server.stop()
+    report(results, elapsed, upstreams)
+    print(
+        "\nphoto bytes uploaded to Telegram: {}".format(
+            upstreams["telegram"].uploaded_bytes
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=50, help="concurrent chats")
+    parser.add_argument("--sessions", type=int, default=20, help="flows per chat")
+    parser.add_argument("--backend", choices=["local", "hcti"], default="local")
+    parser.add_argument("--db", choices=["memory", "postgres"], default="memory")
+    parser.add_argument("--db-latency", type=float, default=0.001)
+    parser.add_argument(
+        "--latency", type=float, default=0.03, help="OWM/HCTI latency, s"
+    )
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--errors", type=float, default=0.0, help="OWM/HCTI error rate")
+    parser.add_argument("--telegram-latency", type=float, default=0.02)
+    parser.add_argument(
+        "--throttle", action="store_true", help="keep per-chat throttling on"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show bot warnings")
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
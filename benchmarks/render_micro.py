@@ -0,0 +1,198 @@
+"""
+Micro-benchmarks for the CPU-bound rendering path, checked against a
+stored baseline. Exits non-zero when a case is slower than its baseline
+by more than --threshold, so it can gate CI.
+
+    python benchmarks/render_micro.py                # compare
+    python benchmarks/render_micro.py --save         # record a new baseline
+    python benchmarks/render_micro.py --only lookup
+
+Each case is timed between two runs of a fixed reference workload (PNG
+encoding plus plain Python) and stored as a multiple of it. That cancels
+most of the difference between machines and of drift within a run, and
+the median over --rounds absorbs the rest. Never change reference():
+doing so invalidates every baseline.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import timeit
+from io import BytesIO
+
+from PIL import Image
+
+from _env import ROOT, setup
+
+setup()
+
+from bot_utils import (  # noqa: E402
+    compose_strip,
+    concat_images,
+    weather_icon,
+)
+from render_utils import (  # noqa: E402
+    HctiRenderer,
+    draw_card,
+    draw_card_png,
+    encode_image,
+)
+from resources import resources  # noqa: E402
+
+BASELINE = os.path.join(ROOT, "benchmarks", "baselines", "render_micro.json")
+BG_COLOR = (134, 185, 224)
+# a realistic 7-day spread of OWM condition codes
+WEATHER_IDS = ["800", "801", "500", "601", "211", "741", "804"]
+# shortest timed batch; short batches keep the interleaving tight
+BATCH_SECONDS = 0.05
+
+
+def cases():
+    hcti = HctiRenderer(resources)
+    cards = [
+        draw_card(weather_icon(weather_id), "2026-10-1" + str(i), "12 °C")
+        for i, weather_id in enumerate(WEATHER_IDS)
+    ]
+    pngs = [draw_card_png("sunny", "2026-10-1" + str(i), "12 °C") for i in range(7)]
+    strip = concat_images(cards, bg_color=BG_COLOR)
+    return {
+        # one forecast's worth of icon lookups
+        "lookup": lambda: [weather_icon(weather_id) for weather_id in WEATHER_IDS],
+        "template_fill": lambda: hcti.html("partlycloudy", "Kyiv", "12 °C"),
+        "draw_card_png": lambda: draw_card_png("chancerain", "Kyiv", "12 °C"),
+        "append_images": lambda: concat_images(cards, bg_color=BG_COLOR),
+        "png_save": lambda: encode_image(strip, "png"),
+        "compose_strip": lambda: compose_strip(pngs, BG_COLOR),
+    }
+
+
+REFERENCE_IMAGE = Image.radial_gradient("L").resize((240, 300)).convert("RGB")
+
+
+def reference():
+    bio = BytesIO()
+    REFERENCE_IMAGE.save(bio, "PNG")
+    return sum(i * i for i in range(20000))
+
+
+class Case:
+    """
+    A timeit.Timer with its loop count fixed once, so repeated measurements
+    of the same case are comparable.
+    """
+
+    def __init__(self, func, repeat: int):
+        self.timer = timeit.Timer(func)
+        self.number = 1
+        while self.timer.timeit(self.number) < BATCH_SECONDS:
+            self.number *= 2
+        self.repeat = repeat
+
+    def measure(self) -> float:
+        """
+        Best of repeat runs, in microseconds per call.
+        """
+        best = min(self.timer.repeat(repeat=self.repeat, number=self.number))
+        return best / self.number * 1e6
+
+
+def measure(funcs: dict, rounds: int, repeat: int) -> dict:
+    """
+    name -> (median cost relative to reference(), best microseconds per call).
+    Every case is timed right after a reference run and followed by another,
+    and is divided by the mean of the two.
+    """
+    ref = Case(reference, repeat)
+    cases = {name: Case(func, repeat) for name, func in funcs.items()}
+    ratios = {name: [] for name in cases}
+    times = {name: [] for name in cases}
+    for _ in range(rounds):
+        before = ref.measure()
+        for name, case in cases.items():
+            elapsed = case.measure()
+            after = ref.measure()
+            ratios[name].append(elapsed / ((before + after) / 2))
+            times[name].append(elapsed)
+            before = after
+    return {name: (statistics.median(ratios[name]), min(times[name])) for name in cases}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.4,
+        help="allowed slowdown over the baseline, 0.4 = 40%%",
+    )
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="write a new baseline")
+    parser.add_argument("--only", nargs="*", help="run only these cases")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    funcs = {
+        name: func
+        for name, func in cases().items()
+        if not args.only or name in args.only
+    }
+    results = {}
+    regressions = []
+    print(
+        "{:<16} {:>12} {:>10} {:>10} {:>8}".format(
+            "case", "us/call", "x ref", "baseline", "change"
+        )
+    )
+    for name, (ratio, elapsed) in measure(funcs, args.rounds, args.repeat).items():
+        results[name] = ratio
+        base = baseline.get(name)
+        if base:
+            change = ratio / base - 1
+            flag = " REGRESSION" if change > args.threshold else ""
+            if flag:
+                regressions.append(name)
+            print(
+                "{:<16} {:>12.1f} {:>10.4g} {:>10.4g} {:>+7.0%}{}".format(
+                    name, elapsed, ratio, base, change, flag
+                )
+            )
+        else:
+            print(
+                "{:<16} {:>12.1f} {:>10.4g} {:>10} {:>8}".format(
+                    name, elapsed, ratio, "-", "-"
+                )
+            )
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as file:
+            json.dump(
+                {
+                    name: round(value, 6)
+                    for name, value in {**baseline, **results}.items()
+                },
+                file,
+                indent=2,
+                sort_keys=True,
+            )
+            file.write("\n")
+        print("baseline written to", os.path.relpath(args.baseline, ROOT))
+    elif regressions:
+        print(
+            "{} slower than baseline by more than {:.0%}".format(
+                ", ".join(regressions), args.threshold
+            )
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Cold import time of the bot's modules, each measured in a fresh
+interpreter, plus the slowest imports reported by -X importtime.
+Nothing touches the network or the database at import time.
+
+    python benchmarks/startup_time.py --runs 10
+    RESOURCE_BUNDLE=/tmp/bundle.zip python benchmarks/startup_time.py
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from _env import DEFAULTS, ROOT, setup
+
+setup()
+
+MODULES = ("resources", "bot_utils", "weather_service", "bot")
+ENV = {name: os.environ[name] for name in DEFAULTS}
+
+
+def run(code: str, *flags) -> subprocess.CompletedProcess:
+    # run from outside the repo so nothing depends on the working directory
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=os.path.dirname(ROOT),
+        env={**os.environ, **ENV, "PYTHONPATH": ROOT},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def import_time(module: str) -> float:
+    code = (
+        "import time; start = time.perf_counter(); import {}; "
+        "print(time.perf_counter() - start)".format(module)
+    )
+    return float(run(code).stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, top: int):
+    stderr = run("import " + module, "-X", "importtime").stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    print("{:<16} {:>10} {:>10}".format("module", "median ms", "min ms"))
+    for module in MODULES:
+        times = [import_time(module) for _ in range(args.runs)]
+        print(
+            "{:<16} {:>10.1f} {:>10.1f}".format(
+                module, statistics.median(times) * 1000, min(times) * 1000
+            )
+        )
+
+    print("\nslowest imports under bot (self time):")
+    for self_us, cumulative_us, name in slowest_imports("bot", args.top):
+        print("  {:>8.1f} ms  {}".format(self_us / 1000, name))
+
+
+if __name__ == "__main__":
+    main()
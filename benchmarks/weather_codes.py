@@ -0,0 +1,110 @@
+"""
+Checks the weather code -> icon table against every OWM condition code
+and times it against the regex lookup it replaced. Exits 1 on a mismatch.
+
+    python benchmarks/weather_codes.py
+"""
+
+import re
+import sys
+import timeit
+
+from _env import setup
+
+setup()
+
+from bot_utils import WEATHER_ICONS, WEATHER_TEMPLATES, weather_icon  # noqa: E402
+
+# https://openweathermap.org/weather-conditions
+EXPECTED = {
+    "chancetstorms": [200, 201, 202, 210, 211, 212, 221, 230, 231, 232],
+    "chancerain": [300, 301, 302, 310, 311, 312, 313, 314, 321]
+    + [500, 501, 502, 503, 504, 511, 520, 521, 522, 531],
+    "flurries": [600, 620],
+    "snow": [601, 602, 621, 622],
+    "sleet": [611, 612, 613, 615, 616],
+    "fogorhazy": [701, 711, 721, 731, 741, 751, 761, 762, 771, 781],
+    "sunny": [800],
+    "partlycloudy": [801],
+    "mostlycloudy": [802, 803],
+    "cloudy": [804],
+}
+
+# the previous implementation, kept for comparison
+LEGACY_ICONS = [
+    ("2..", "chancetstorms"),
+    ("3..", "chancerain"),
+    ("5..", "chancerain"),
+    ("60.", "snow"),
+    ("61.", "sleet"),
+    ("62.", "sleet"),
+    ("7.", "fogorhazy"),
+    ("800", "sunny"),
+    ("801", "partlycloudy"),
+    ("802", "mostlycloudy"),
+    ("803", "mostlycloudy"),
+    ("804", "cloudy"),
+]
+
+
+def legacy_lookup(s, lookups=LEGACY_ICONS):
+    for pattern, value in lookups:
+        if re.search(pattern, s):
+            return value
+    return None
+
+
+def check() -> list:
+    failures = []
+    codes = [code for group in EXPECTED.values() for code in group]
+    for icon, group in EXPECTED.items():
+        for code in group:
+            for weather_id in (code, str(code)):
+                if weather_icon(weather_id) != icon:
+                    failures.append(
+                        "{!r}: {} != {}".format(
+                            weather_id, weather_icon(weather_id), icon
+                        )
+                    )
+    for icon in set(WEATHER_ICONS.values()) | set(EXPECTED):
+        if icon not in WEATHER_TEMPLATES:
+            failures.append("no template for " + icon)
+    for weather_id in ("170", "199", "805", "900", "", "80", None):
+        if weather_icon(weather_id) is not None:
+            failures.append("{!r} should not map to an icon".format(weather_id))
+    if "\n" in "".join(WEATHER_TEMPLATES.values()):
+        failures.append("templates are not minified")
+
+    changed = [
+        (code, legacy_lookup(str(code)), weather_icon(code))
+        for code in codes
+        if legacy_lookup(str(code)) != weather_icon(code)
+    ]
+    print("{} codes checked; differences from the regex lookup:".format(len(codes)))
+    for code, old, new in changed:
+        print("  {}: {} -> {}".format(code, old, new))
+    return failures
+
+
+def bench():
+    ids = [str(code) for group in EXPECTED.values() for code in group]
+    for name, func in (
+        ("regex lookup", lambda: [legacy_lookup(i) for i in ids]),
+        ("table lookup", lambda: [weather_icon(i) for i in ids]),
+    ):
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=5, number=number)) / number / len(ids)
+        print("{:<14} {:8.3f} us/code".format(name, best * 1e6))
+
+
+def main():
+    failures = check()
+    bench()
+    if failures:
+        print("\n".join(["FAILED:"] + failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
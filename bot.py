@@ -1,42 +1,127 @@
 from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.dispatcher import Dispatcher
 from aiogram.utils import executor
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
-import asyncio
-import aiohttp
+from aiohttp import web
 from db_utils import Database
+from cache_utils import PostgresCardStore
+from http_utils import http_client
+from worker_utils import image_pool
+from photo_utils import PhotoSender
+from owm_utils import get_current_weather, owm_cache
+from weather_service import WeatherRequest, weather_service
+from forecast_warmer import ForecastWarmer
+from broadcaster import ForecastBroadcaster
+from limit_utils import (
+    Overloaded,
+    ThrottlingMiddleware,
+    forecast_limit,
+    hcti_limit,
+    owm_limit,
+)
+from metrics import (
+    GaugeFunc,
+    MetricsMiddleware,
+    cache_stats,
+    metrics_view,
+    observe_service,
+    start_server,
+)
+from geo_utils import Geocoder
+from migrate import pending
+from storage_utils import PostgresStorage, get_storage
 
 import json
 from io import BytesIO
-import datetime
 
 import logging
-
-from config import TOKEN, OWM_TOKEN
+import re
+
+from config import (
+    TOKEN,
+    TELEGRAM_API_BASE,
+    BOT_MODE,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_CHECK_IP,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    METRICS_HOST,
+    METRICS_PORT,
+    CARD_CACHE_STORE,
+)
 from bot_utils import (
-    OWM_API_URL_FIND,
-    OWM_API_URL_WEATHER,
-    OWM_API_ONECALL_URL_FORECAST,
-    get_img_weather_url,
     WEATHER_UNITS,
+    CARD_STORE_OPTIONS,
+    card_cache,
     metric_cb,
     details_cb,
-    concat_imgs_by_urls,
     get_menu_buttons,
+    subscription_button,
 )
 
 logging.basicConfig(level=logging.INFO)
 
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
+bot = Bot(
+    token=TOKEN,
+    server=(
+        TelegramAPIServer.from_base(TELEGRAM_API_BASE)
+        if TELEGRAM_API_BASE
+        else TELEGRAM_PRODUCTION
+    ),
+)
+db = Database()
+storage = get_storage(db)
 dp = Dispatcher(bot, storage=storage)
-
-
-loop = asyncio.get_event_loop()
-db = Database(loop)
+throttling = ThrottlingMiddleware()
+dp.middleware.setup(MetricsMiddleware())
+dp.middleware.setup(throttling)
+photos = PhotoSender(bot)
+
+geocoder = Geocoder(db)
+warmer = ForecastWarmer(db, weather_service)
+broadcaster = ForecastBroadcaster(db, weather_service, photos)
+
+weather_service.add_hook(observe_service)
+cache_stats.add("owm", owm_cache.stats)
+if CARD_CACHE_STORE == "postgres":
+    card_cache.store = PostgresCardStore(db, **CARD_STORE_OPTIONS)
+cache_stats.add("card", card_cache.memory.stats)
+if card_cache.store is not None:
+    cache_stats.add("card_store", card_cache.store.stats)
+cache_stats.add("user", db.user_cache.stats)
+cache_stats.add("geocode", geocoder.memory.stats)
+cache_stats.add("forecast", weather_service.forecasts.stats)
+cache_stats.add("file_id", photos.stats)
+GaugeFunc(
+    "bot_forecast_renders_saved",
+    "Forecast renders avoided by joining one in flight.",
+    lambda: weather_service.renders_saved,
+)
+GaugeFunc(
+    "bot_forecast_warm_hit_ratio",
+    "Share of forecast requests served from pre-rendered strips.",
+    weather_service.warm_hit_ratio,
+)
+GaugeFunc(
+    "bot_throttled_updates",
+    "Updates rejected by the per-chat throttle.",
+    lambda: throttling.rejected,
+)
+for field in ("active", "rejected"):
+    GaugeFunc(
+        "bot_limit_" + field,
+        "Concurrency limit slots {} by limit.".format(field),
+        lambda field=field: {
+            (limit.name,): getattr(limit, field)
+            for limit in (forecast_limit, hcti_limit, owm_limit)
+        },
+        ["limit"],
+    )
 
 
 class CityForm(StatesGroup):
@@ -63,13 +148,53 @@ class ForecastLocationForm(StatesGroup):
     location = State()
 
 
+async def send_current_weather(chat_id: int, request: WeatherRequest):
+    weather = await weather_service.current(request)
+    kb = types.InlineKeyboardMarkup()
+    kb.add(
+        types.InlineKeyboardButton(
+            text="Details",
+            callback_data=details_cb.new(
+                lat=weather.lat, lon=weather.lon, city=weather.city
+            ),
+        )
+    )
+    if weather.photo is None:
+        await bot.send_message(
+            chat_id=chat_id,
+            text=weather.caption,
+            parse_mode="markdown",
+            reply_markup=kb,
+        )
+    else:
+        await photos.send_photo(
+            chat_id=chat_id,
+            photo=weather.photo,
+            key=weather.photo_key,
+            caption=weather.caption,
+            parse_mode="markdown",
+            reply_markup=kb,
+        )
+    return weather
+
+
+async def send_forecast(chat_id: int, request: WeatherRequest):
+    forecast = await weather_service.forecast(request)
+    bio = BytesIO(forecast.photo)
+    bio.name = str(chat_id) + "." + forecast.ext
+    await photos.send_photo(
+        chat_id=chat_id,
+        photo=bio,
+        caption=forecast.caption,
+        parse_mode="markdown",
+    )
+    bio.close()
+    return forecast
+
+
 @dp.message_handler(commands=["start"])
 async def process_start_command(message: types.Message):
-    user = await db.current_user(message.chat.id)
-    if user:
-        pass
-    else:
-        await db.add_user(message.chat.id)
+    await db.upsert_user(message.chat.id)
 
     menu_buttons = await get_menu_buttons()
     await message.answer(text="Hello!", reply_markup=menu_buttons)
@@ -151,72 +276,26 @@ async def process_city(message: types.Message, state: FSMContext):
         data["city"] = message.text
     await state.finish()
 
-    s_city = data["city"]
-    units = await db.get_user_metric(message.chat.id)
-    params = {
-        "q": s_city,
-        "type": "like",
-        "units": WEATHER_UNITS[units][0],
-        "APPID": OWM_TOKEN,
-    }
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=OWM_API_URL_FIND, params=params) as response:
-                r = await response.json()
-
-        city = r["list"][0]
-    except IndexError:
+    city = await geocoder.lookup(data["city"])
+    if city is None:
         return await bot.send_message(
             chat_id=message.chat.id, text="Sorry, no city found"
         )
 
-    img = await get_img_weather_url(
-        city["name"],
-        str(round(city["main"]["temp"])),
-        str(city["weather"][0]["id"]),
-        WEATHER_UNITS[units][1],
-    )
-    caption = (
-        "Current temp in {city} is {degrees:.0f} {metric} \n"
-        "*{description}*\n"
-        "Feels like {feels} {metric}\n".format(
-            city=city["name"],
-            degrees=city["main"]["temp"],
-            metric=WEATHER_UNITS[units][1],
-            description=city["weather"][0]["description"].capitalize(),
-            feels=round(city["main"]["feels_like"]),
-        )
-    )
-
-    kb = types.InlineKeyboardMarkup()
-    kb.add(
-        types.InlineKeyboardButton(
-            text="Details",
-            callback_data=details_cb.new(
-                lat=city["coord"]["lat"], lon=city["coord"]["lon"], city=city["name"]
-            ),
-        )
-    )
-
-    await bot.send_photo(
-        chat_id=message.chat.id,
-        photo=img["url"],
-        caption=caption,
-        parse_mode="markdown",
-        reply_markup=kb,
+    units = await db.get_user_metric(message.chat.id)
+    await send_current_weather(
+        message.chat.id,
+        WeatherRequest(
+            lat=city["lat"], lon=city["lon"], units=units, city=city["name"]
+        ),
     )
 
     location = {
-        "lat": str(city["coord"]["lat"]),
-        "lon": str(city["coord"]["lon"]),
+        "lat": str(city["lat"]),
+        "lon": str(city["lon"]),
         "city": city["name"],
     }
-    current_location = await db.get_user_location(message.chat.id)
-    if current_location:
-        pass
-    else:
-        await db.set_user_location(message.chat.id, location)
+    await db.set_location_if_absent(message.chat.id, location)
 
 
 @dp.callback_query_handler(
@@ -228,50 +307,9 @@ async def current_weather_location(callback_query: types.CallbackQuery):
         lon = query_data[4]
         lat = query_data[6]
         units = await db.get_user_metric(callback_query.message.chat.id)
-        params = {
-            "lat": lat,
-            "lon": lon,
-            "units": WEATHER_UNITS[units][0],
-            "APPID": OWM_TOKEN,
-        }
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=OWM_API_URL_WEATHER, params=params) as response:
-                r = await response.json()
-        img = await get_img_weather_url(
-            r["name"],
-            str(round(r["main"]["temp"])),
-            str(r["weather"][0]["id"]),
-            WEATHER_UNITS[units][1],
-        )
-        caption = (
-            "Current temp in {city} is {degrees:.0f} {metric} \n"
-            "*{description}*\n"
-            "Feels like {feels} {metric}".format(
-                city=r["name"],
-                degrees=r["main"]["temp"],
-                metric=WEATHER_UNITS[units][1],
-                description=r["weather"][0]["description"].capitalize(),
-                feels=round(r["main"]["feels_like"]),
-            )
-        )
-
-        kb = types.InlineKeyboardMarkup()
-        kb.add(
-            types.InlineKeyboardButton(
-                text="Details",
-                callback_data=details_cb.new(
-                    lat=r["coord"]["lat"], lon=r["coord"]["lon"], city=r["name"]
-                ),
-            )
-        )
-
-        await bot.send_photo(
-            chat_id=callback_query.message.chat.id,
-            photo=img["url"],
-            caption=caption,
-            parse_mode="markdown",
-            reply_markup=kb,
+        await send_current_weather(
+            callback_query.message.chat.id,
+            WeatherRequest(lat=lat, lon=lon, units=units),
         )
     else:
         await LocationForm.location.set()
@@ -293,132 +331,49 @@ async def process_geo(message: types.Message, state: FSMContext):
     lat = message.location.latitude
     lon = message.location.longitude
     units = await db.get_user_metric(message.chat.id)
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "units": WEATHER_UNITS[units][0],
-        "APPID": OWM_TOKEN,
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url=OWM_API_URL_WEATHER, params=params) as response:
-            r = await response.json()
-
-    img = await get_img_weather_url(
-        r["name"],
-        str(round(r["main"]["temp"])),
-        str(r["weather"][0]["id"]),
-        WEATHER_UNITS[units][1],
-    )
-    caption = (
-        "Current temp in {city} is {degrees:.0f} {metric} \n"
-        "*{description}*\n"
-        "Feels like {feels} {metric}".format(
-            city=r["name"],
-            degrees=r["main"]["temp"],
-            metric=WEATHER_UNITS[units][1],
-            description=r["weather"][0]["description"].capitalize(),
-            feels=round(r["main"]["feels_like"]),
-        )
-    )
-
-    kb = types.InlineKeyboardMarkup()
-    kb.add(
-        types.InlineKeyboardButton(
-            text="Details",
-            callback_data=details_cb.new(
-                lat=r["coord"]["lat"], lon=r["coord"]["lon"], city=r["name"]
-            ),
-        )
+    weather = await send_current_weather(
+        message.chat.id, WeatherRequest(lat=lat, lon=lon, units=units)
     )
 
-    await bot.send_photo(
-        chat_id=message.chat.id,
-        photo=img["url"],
-        caption=caption,
-        parse_mode="markdown",
-        reply_markup=kb,
-    )
-
-    location = {"lat": str(lat), "lon": str(lon), "city": r["name"]}
+    location = {"lat": str(lat), "lon": str(lon), "city": weather.city}
     await db.set_user_location(message.chat.id, location)
 
 
 @dp.callback_query_handler(details_cb.filter())
 async def weather_details(callback_query: types.CallbackQuery, callback_data: dict):
-    lat = callback_data["lat"]
-    lon = callback_data["lon"]
-    city = callback_data["city"]
-
     units = await db.get_user_metric(callback_query.message.chat.id)
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "units": WEATHER_UNITS[units][0],
-        "exclude": "minutly,hourly",
-        "appid": OWM_TOKEN,
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            url=OWM_API_ONECALL_URL_FORECAST, params=params
-        ) as response:
-            r = await response.json()
-
-    if r["current"]["uvi"] > 2:
-        uvi_description = "*UV index is heightended*"
-    else:
-        uvi_description = ""
-
-    if r["current"]["wind_speed"] <= 5:
-        wind_speed_description = "(Gentle breeze)"
-    elif r["current"]["wind_speed"] <= 8:
-        wind_speed_description = "(Moderate breeze)"
-    elif r["current"]["wind_speed"] <= 11:
-        wind_speed_description = "(Fresh breeze)"
-    else:
-        wind_speed_description = "*Strong breeze*"
-
-    brief = (
-        "Current temp in {city} is {degrees:.0f} {metric} \n"
-        "*{description}*\n"
-        "Feels like {feels} {metric}".format(
-            city=city,
-            degrees=r["current"]["temp"],
-            metric=WEATHER_UNITS[units][1],
-            description=r["current"]["weather"][0]["description"].capitalize(),
-            feels=r["current"]["feels_like"],
+    details = await weather_service.details(
+        WeatherRequest(
+            lat=callback_data["lat"],
+            lon=callback_data["lon"],
+            units=units,
+            city=callback_data["city"],
         )
     )
-    details = (
-        "\nPressure: {pressure} hPa\n"
-        "Humidity: {humidity}%\n"
-        "UV index: {uvi} {uvi_description}\n"
-        "Wind speed: {wind_speed}m/s {wind_speed_description}".format(
-            pressure=r["current"]["pressure"],
-            humidity=r["current"]["humidity"],
-            uvi=r["current"]["uvi"],
-            uvi_description=uvi_description,
-            wind_speed=r["current"]["wind_speed"],
-            wind_speed_description=wind_speed_description,
+    # current weather goes out as plain text when no card could be rendered
+    if callback_query.message.photo:
+        await bot.edit_message_caption(
+            chat_id=callback_query.message.chat.id,
+            message_id=callback_query.message.message_id,
+            caption=details.caption,
+            parse_mode="markdown",
+        )
+    else:
+        await bot.edit_message_text(
+            chat_id=callback_query.message.chat.id,
+            message_id=callback_query.message.message_id,
+            text=details.caption,
+            parse_mode="markdown",
         )
-    )
-
-    new_caption = brief + details
-    await bot.edit_message_caption(
-        chat_id=callback_query.message.chat.id,
-        message_id=callback_query.message.message_id,
-        caption=new_caption,
-        parse_mode="markdown",
-    )
     return await bot.answer_callback_query(callback_query_id=callback_query.id)
 
 
 @dp.message_handler(text=["Settings"])
 async def settings(message: types.Message):
     kb = types.InlineKeyboardMarkup()
-    user_location = await db.get_user_location(message.chat.id)
-    metric = await db.get_user_metric(message.chat.id)
+    user_settings = await db.get_user_settings(message.chat.id)
+    user_location = user_settings["location"]
+    metric = user_settings["metric"]
     if user_location:
         location = json.loads(user_location)
         location_text = "Your saved location: {city}({lat}, {lon})\n".format(
@@ -463,6 +418,7 @@ async def settings(message: types.Message):
                 ),
             )
         )
+    kb.add(subscription_button(user_settings.get("subscribed")))
     return await message.answer(
         text=msg_text,
         reply_markup=kb,
@@ -514,23 +470,15 @@ async def process_change_city(message: types.Message, state: FSMContext):
         data["city"] = message.text
     await state.finish()
 
-    s_city = data["city"]
-    params = {"q": s_city, "type": "like", "APPID": OWM_TOKEN}
-
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=OWM_API_URL_FIND, params=params) as response:
-                r = await response.json()
-
-        city = r["list"][0]
-    except IndexError:
+    city = await geocoder.lookup(data["city"])
+    if city is None:
         return await bot.send_message(
             chat_id=message.chat.id, text="Sorry, no city found"
         )
 
     location = {
-        "lat": str(city["coord"]["lat"]),
-        "lon": str(city["coord"]["lon"]),
+        "lat": str(city["lat"]),
+        "lon": str(city["lon"]),
         "city": city["name"],
     }
     await db.set_user_location(message.chat.id, location)
@@ -561,13 +509,9 @@ async def change_geo(message: types.Message, state: FSMContext):
 
     lat = message.location.latitude
     lon = message.location.longitude
-    params = {"lat": lat, "lon": lon, "APPID": OWM_TOKEN}
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url=OWM_API_URL_WEATHER, params=params) as response:
-            r = await response.json()
+    r = await get_current_weather(lat=lat, lon=lon, units="metric")
 
-    location = {"lat": str(lat), "lon": str(lon), "city": r["name"]}
+    location = {"lat": str(lat), "lon": str(lon), "city": r.name}
     await db.set_user_location(message.chat.id, location)
     await message.reply(
         text="Your location was successfully saved. You can check all your settings with Settings button in menu.",
@@ -576,11 +520,8 @@ async def change_geo(message: types.Message, state: FSMContext):
 
 @dp.callback_query_handler(metric_cb.filter())
 async def change_metric(callback_query: types.CallbackQuery, callback_data: dict):
-    await db.change_user_metric(callback_query.message.chat.id)
-    if callback_data["metric"] == "celsius":
-        metric = "fahrenheit"
-    else:
-        metric = "celsius"
+    metric = await db.toggle_metric(callback_query.message.chat.id)
+    user_settings = await db.get_user_settings(callback_query.message.chat.id)
     kb = types.InlineKeyboardMarkup()
 
     if callback_data["city"] == "None":
@@ -628,6 +569,7 @@ async def change_metric(callback_query: types.CallbackQuery, callback_data: dict
                 ),
             )
         )
+    kb.add(subscription_button(user_settings and user_settings.get("subscribed")))
     await bot.edit_message_text(
         chat_id=callback_query.message.chat.id,
         message_id=callback_query.message.message_id,
@@ -637,6 +579,37 @@ async def change_metric(callback_query: types.CallbackQuery, callback_data: dict
     return await bot.answer_callback_query(callback_query_id=callback_query.id)
 
 
+@dp.callback_query_handler(lambda query: query.data == "toggle_subscription")
+async def toggle_subscription(callback_query: types.CallbackQuery):
+    chat_id = callback_query.message.chat.id
+    if not await db.get_user_location(chat_id):
+        return await bot.answer_callback_query(
+            callback_query_id=callback_query.id,
+            text="Save a location first to get a daily forecast.",
+            show_alert=True,
+        )
+    subscribed = await db.toggle_subscription(chat_id)
+    kb = callback_query.message.reply_markup
+    if kb:
+        for row in kb.inline_keyboard:
+            for i, button in enumerate(row):
+                if button.callback_data == "toggle_subscription":
+                    row[i] = subscription_button(subscribed)
+        await bot.edit_message_reply_markup(
+            chat_id=chat_id,
+            message_id=callback_query.message.message_id,
+            reply_markup=kb,
+        )
+    return await bot.answer_callback_query(
+        callback_query_id=callback_query.id,
+        text=(
+            "You will get a forecast for your saved location every morning."
+            if subscribed
+            else "Daily forecast turned off."
+        ),
+    )
+
+
 @dp.message_handler(text=["Weather forecast"])
 async def weather_forecast(message: types.Message):
 
@@ -693,59 +666,10 @@ async def forecast_location(callback_query: types.CallbackQuery):
         lon = query_data[3]
         lat = query_data[5]
         units = await db.get_user_metric(callback_query.message.chat.id)
-        params = {
-            "lat": lat,
-            "lon": lon,
-            "units": WEATHER_UNITS[units][0],
-            "exclude": "minutly,hourly",
-            "appid": OWM_TOKEN,
-        }
-
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url=OWM_API_ONECALL_URL_FORECAST, params=params
-            ) as response:
-                r = await response.json()
-
-        forecast_imgs = []
-        for index, day in enumerate(r["daily"]):
-            if index == 7:
-                break
-            time = datetime.datetime.fromtimestamp(int(day["dt"]))
-            img = await get_img_weather_url(
-                weather=str(round(day["temp"]["day"])),
-                city=f"{time:%Y-%m-%d}",
-                weather_id=str(day["weather"][0]["id"]),
-                metric=WEATHER_UNITS[units][1],
-            )
-            forecast_imgs.append(img["url"])
-
-        img = await concat_imgs_by_urls(forecast_imgs, bg_color=(134, 185, 224))
-
-        bio = BytesIO()
-        bio.name = str(callback_query.message.chat.id) + ".png"
-        img.save(bio, "PNG")
-        bio.seek(0)
-
-        alerts = ""
-        if "alerts" in r:
-            caption = "*National alerts*:\n"
-            for alert in r["alerts"]:
-                start = datetime.datetime.fromtimestamp(int(alert["start"]))
-                end = datetime.datetime.fromtimestamp(int(alert["end"]))
-                alerts = alerts + "{start} - {end}:\n {description}\n".format(
-                    start=f"{start:%m-%d %H:%M:%S}",
-                    end=f"{end:%m-%d %H:%M:%S}",
-                    description=alert["description"].replace("*", "\\*"),
-                )
-            alerts = caption + alerts
-        await bot.send_photo(
-            chat_id=callback_query.message.chat.id,
-            photo=bio,
-            caption=alerts,
-            parse_mode="markdown",
+        await send_forecast(
+            callback_query.message.chat.id,
+            WeatherRequest(lat=lat, lon=lon, units=units),
         )
-        bio.close()
         await bot.delete_message(
             chat_id=callback_query.message.chat.id,
             message_id=callback_query.message.message_id,
@@ -774,65 +698,15 @@ async def forecast_location_new(message: types.Message, state: FSMContext):
     )
 
     units = await db.get_user_metric(message.chat.id)
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "units": WEATHER_UNITS[units][0],
-        "exclude": "minutly,hourly",
-        "appid": OWM_TOKEN,
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            url=OWM_API_ONECALL_URL_FORECAST, params=params
-        ) as response:
-            r = await response.json()
-
-    forecast_imgs = []
-    for index, day in enumerate(r["daily"]):
-        if index == 7:
-            break
-        time = datetime.datetime.fromtimestamp(int(day["dt"]))
-        img = await get_img_weather_url(
-            weather=str(round(day["temp"]["day"])),
-            city=f"{time:%Y-%m-%d}",
-            weather_id=str(day["weather"][0]["id"]),
-            metric=WEATHER_UNITS[units][1],
-        )
-        forecast_imgs.append(img["url"])
-
-    img = await concat_imgs_by_urls(forecast_imgs, bg_color=(134, 185, 224))
-
-    bio = BytesIO()
-    bio.name = str(message.chat.id) + ".png"
-    img.save(bio, "PNG")
-    bio.seek(0)
-
-    alerts = ""
-    if "alerts" in r:
-        caption = "*National alerts*:\n"
-        for alert in r["alerts"]:
-            start = datetime.datetime.fromtimestamp(int(alert["start"]))
-            end = datetime.datetime.fromtimestamp(int(alert["end"]))
-            alerts = alerts + "{start} - {end}:\n {description}\n".format(
-                start=f"{start:%m-%d %H:%M:%S}",
-                end=f"{end:%m-%d %H:%M:%S}",
-                description=alert["description"].replace("*", "\\*"),
-            )
-        alerts = caption + alerts
-    await bot.send_photo(
-        chat_id=message.chat.id,
-        photo=bio,
-        caption=alerts,
-        parse_mode="markdown",
+    forecast = await send_forecast(
+        message.chat.id, WeatherRequest(lat=lat, lon=lon, units=units)
     )
-    bio.close()
     await bot.delete_message(
         chat_id=message.chat.id,
         message_id=message.message_id + 1,
     )
 
-    location = {"lat": str(lat), "lon": str(lon), "city": r["timezone"]}
+    location = {"lat": str(lat), "lon": str(lon), "city": forecast.timezone}
     await db.set_user_location(message.chat.id, location)
 
 
@@ -858,20 +732,8 @@ async def forecast_city_process(message: types.Message, state: FSMContext):
         text="Preparing your weather forecast...", chat_id=message.chat.id
     )
 
-    units = await db.get_user_metric(message.chat.id)
-    params = {
-        "q": data["city"],
-        "type": "like",
-        "units": WEATHER_UNITS[units][0],
-        "APPID": OWM_TOKEN,
-    }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=OWM_API_URL_FIND, params=params) as response:
-                r = await response.json()
-
-        city = r["list"][0]
-    except IndexError:
+    city = await geocoder.lookup(data["city"])
+    if city is None:
         await bot.delete_message(
             chat_id=message.chat.id,
             message_id=message.message_id + 1,
@@ -880,71 +742,105 @@ async def forecast_city_process(message: types.Message, state: FSMContext):
             chat_id=message.chat.id, text="Sorry, no city found"
         )
 
-    params = {
-        "lat": city["coord"]["lat"],
-        "lon": city["coord"]["lon"],
-        "units": WEATHER_UNITS[units][0],
-        "exclude": "minutly,hourly",
-        "appid": OWM_TOKEN,
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.get(
-            url=OWM_API_ONECALL_URL_FORECAST, params=params
-        ) as response:
-            r = await response.json()
-
-    forecast_imgs = []
-    for index, day in enumerate(r["daily"]):
-        if index == 7:
-            break
-        time = datetime.datetime.fromtimestamp(int(day["dt"]))
-        img = await get_img_weather_url(
-            weather=str(round(day["temp"]["day"])),
-            city=f"{time:%Y-%m-%d}",
-            weather_id=str(day["weather"][0]["id"]),
-            metric=WEATHER_UNITS[units][1],
-        )
-        forecast_imgs.append(img["url"])
-
-    img = await concat_imgs_by_urls(forecast_imgs, bg_color=(134, 185, 224))
-
-    bio = BytesIO()
-    bio.name = str(message.chat.id) + ".png"
-    img.save(bio, "PNG")
-    bio.seek(0)
-
-    alerts = ""
-    if "alerts" in r:
-        caption = "*National alerts*:\n"
-        for alert in r["alerts"]:
-            start = datetime.datetime.fromtimestamp(int(alert["start"]))
-            end = datetime.datetime.fromtimestamp(int(alert["end"]))
-            alerts = alerts + "{start} - {end}:\n {description}\n".format(
-                start=f"{start:%m-%d %H:%M:%S}",
-                end=f"{end:%m-%d %H:%M:%S}",
-                description=alert["description"].replace("*", "\\*"),
-            )
-        alerts = caption + alerts
-    await bot.send_photo(
-        chat_id=message.chat.id,
-        photo=bio,
-        caption=alerts,
-        parse_mode="markdown",
+    units = await db.get_user_metric(message.chat.id)
+    await send_forecast(
+        message.chat.id,
+        WeatherRequest(
+            lat=city["lat"], lon=city["lon"], units=units, city=city["name"]
+        ),
     )
-    bio.close()
     await bot.delete_message(
         chat_id=message.chat.id,
         message_id=message.message_id + 1,
     )
 
     location = {
-        "lat": str(city["coord"]["lat"]),
-        "lon": str(city["coord"]["lat"]),
+        "lat": str(city["lat"]),
+        "lon": str(city["lon"]),
         "city": city["name"],
     }
     await db.set_user_location(message.chat.id, location)
 
 
+@dp.errors_handler(exception=Overloaded)
+async def overloaded_handler(update: types.Update, exception: Overloaded):
+    logging.warning("Rejected update %s: %s", update.update_id, exception)
+    if update.callback_query and update.callback_query.message:
+        chat_id = update.callback_query.message.chat.id
+    elif update.message:
+        chat_id = update.message.chat.id
+    else:
+        return True
+    await bot.send_message(
+        chat_id=chat_id, text="The bot is busy right now, please try again in a minute."
+    )
+    return True
+
+
+async def on_startup(dispatcher: Dispatcher):
+    await db.connect()
+    missing = await pending(db)
+    if missing:
+        logging.warning(
+            "Pending migrations %s, run python migrate.py", ", ".join(missing)
+        )
+    if isinstance(storage, PostgresStorage):
+        storage.start()
+    await http_client.start()
+    await geocoder.warm()
+    warmer.start()
+    broadcaster.start()
+    if BOT_MODE == "webhook":
+        await bot.set_webhook(WEBHOOK_HOST + webhook_path())
+    elif METRICS_PORT:
+        dispatcher["metrics_runner"] = await start_server(METRICS_HOST, METRICS_PORT)
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    if "metrics_runner" in dispatcher:
+        await dispatcher["metrics_runner"].cleanup()
+    await broadcaster.stop()
+    await warmer.stop()
+    await http_client.close()
+    await db.close()
+    image_pool.shutdown()
+
+
+async def health(request: web.Request):
+    return web.json_response({"status": "ok"})
+
+
+def webhook_path() -> str:
+    """
+    The route Telegram posts updates to, ending in the secret segment.
+    """
+    return "{}/{}".format(WEBHOOK_PATH.rstrip("/"), WEBHOOK_SECRET)
+
+
+def start_webhook():
+    if not WEBHOOK_HOST:
+        raise SystemExit("BOT_MODE=webhook needs WEBHOOK_HOST")
+    if len(WEBHOOK_SECRET) < 16 or not re.fullmatch(r"[A-Za-z0-9_-]+", WEBHOOK_SECRET):
+        raise SystemExit(
+            "BOT_MODE=webhook needs WEBHOOK_SECRET: at least 16 characters "
+            "from A-Z, a-z, 0-9, _ and -"
+        )
+    app = web.Application()
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics_view)
+    runner = executor.set_webhook(
+        dp,
+        webhook_path=webhook_path(),
+        on_startup=on_startup,
+        on_shutdown=on_shutdown,
+        check_ip=WEBHOOK_CHECK_IP,
+        web_app=app,
+    )
+    runner.run_app(host=WEBAPP_HOST, port=WEBAPP_PORT)
+
+
 if __name__ == "__main__":
-    executor.start_polling(dp)
+    if BOT_MODE == "webhook":
+        start_webhook()
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
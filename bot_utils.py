@@ -1,67 +1,100 @@
+import asyncio
+import datetime
 import logging
 
-import aiohttp
-import re
 from aiogram.utils.callback_data import CallbackData
 from aiogram import types
 
 from io import BytesIO
 from PIL import Image
 
-from config import HCTI_API_KEY, HCTI_API_USER_ID, HCTI_API_ENDPOINT
-
-
-OWM_API_URL_FIND = "http://api.openweathermap.org/data/2.5/find"
-OWM_API_URL_WEATHER = "https://api.openweathermap.org/data/2.5/weather"
-OWM_API_ONECALL_URL_FORECAST = "https://api.openweathermap.org/data/2.5/onecall"
-
-with open("staticfiles/weather_icons.css", "r") as file:
-    CSS_WEATHER = file.read()
-
-with open("templates/sunny.html", "r") as file:
-    HTML_SUNNY = file.read()
-
-with open("templates/partlycloudy.html", "r") as file:
-    HTML_PARTLYCLOUDY = file.read()
-
-with open("templates/mostlycloudy.html", "r") as file:
-    HTML_MOSTLYCLOUDY = file.read()
-
-with open("templates/cloudy.html", "r") as file:
-    HTML_CLOUDY = file.read()
-
-with open("templates/fogorhazy.html", "r") as file:
-    HTML_FOGORHAZY = file.read()
-
-with open("templates/chancerain.html", "r") as file:
-    HTML_CHANCERAIN = file.read()
-
-with open("templates/chancetstorms.html", "r") as file:
-    HTML_TSTORMS = file.read()
+from config import (
+    OWM_API_BASE,
+    RENDER_BACKEND,
+    CARD_CACHE_SIZE,
+    CARD_CACHE_TTL,
+    CARD_CACHE_STORE,
+    CARD_CACHE_DIR,
+    CARD_CACHE_STORE_TTL,
+    CARD_CACHE_STORE_MAX_MB,
+    CARD_CACHE_SWEEP_INTERVAL,
+    FORECAST_CONCURRENCY,
+    FORECAST_CARD_TIMEOUT,
+)
+from cache_utils import LRUCache, DiskCache, CardCache
+from http_utils import http_client
+from resources import resources
+from render_utils import LocalRenderer, HctiRenderer, CARD_SIZE, encode_image
+from worker_utils import image_pool
+
+OWM_API_URL_FIND = OWM_API_BASE + "/data/2.5/find"
+OWM_API_URL_WEATHER = OWM_API_BASE + "/data/2.5/weather"
+OWM_API_ONECALL_URL_FORECAST = OWM_API_BASE + "/data/2.5/onecall"
+
+# icon name -> minified HTML, read on first use
+WEATHER_TEMPLATES = resources.templates
+
+
+def classify_weather(code: int):
+    """
+    Icon for an OWM condition code, see
+    https://openweathermap.org/weather-conditions
+    """
+    group = code // 100
+    if group == 2:
+        return "chancetstorms"
+    if group in (3, 5):
+        return "chancerain"
+    if group == 6:
+        if code in (600, 620):
+            return "flurries"
+        if 611 <= code <= 616:
+            return "sleet"
+        return "snow"
+    if group == 7:
+        return "fogorhazy"
+    return {
+        800: "sunny",
+        801: "partlycloudy",
+        802: "mostlycloudy",
+        803: "mostlycloudy",
+        804: "cloudy",
+    }.get(code)
+
+
+# "<code>" -> icon name for every code in 200..804, built once at import
+WEATHER_ICONS = {
+    str(code): icon
+    for code, icon in ((code, classify_weather(code)) for code in range(200, 805))
+    if icon is not None
+}
 
-with open("templates/sleet.html", "r") as file:
-    HTML_SLEET = file.read()
 
-with open("templates/flurries.html", "r") as file:
-    HTML_FLURRIES = file.read()
+def weather_icon(weather_id):
+    return WEATHER_ICONS.get(str(weather_id))
 
-with open("templates/snow.html", "r") as file:
-    HTML_SNOW = file.read()
 
-WEATHER_ICONS_HTML = [
-    ("2..", HTML_TSTORMS),
-    ("3..", HTML_CHANCERAIN),
-    ("5..", HTML_CHANCERAIN),
-    ("60.", HTML_SNOW),
-    ("61.", HTML_SLEET),
-    ("62.", HTML_SLEET),
-    ("7.", HTML_FOGORHAZY),
-    ("800", HTML_SUNNY),
-    ("801", HTML_PARTLYCLOUDY),
-    ("802", HTML_MOSTLYCLOUDY),
-    ("803", HTML_MOSTLYCLOUDY),
-    ("804", HTML_CLOUDY),
-]
+RENDERERS = {
+    "local": LocalRenderer,
+    "hcti": lambda: HctiRenderer(resources),
+}
+renderer = RENDERERS[RENDER_BACKEND]()
+
+# card store settings shared by DiskCache and PostgresCardStore
+CARD_STORE_OPTIONS = dict(
+    ttl=CARD_CACHE_STORE_TTL,
+    max_bytes=CARD_CACHE_STORE_MAX_MB * 1024 * 1024,
+    sweep_interval=CARD_CACHE_SWEEP_INTERVAL,
+)
+# the "postgres" store needs the database and is attached in bot.py
+card_cache = CardCache(
+    LRUCache(maxsize=CARD_CACHE_SIZE, ttl=CARD_CACHE_TTL),
+    (
+        DiskCache(CARD_CACHE_DIR, **CARD_STORE_OPTIONS)
+        if CARD_CACHE_STORE == "disk" and CARD_CACHE_DIR
+        else None
+    ),
+)
 
 WEATHER_UNITS = {
     "celsius": ["metric", "\N{DEGREE SIGN}C"],
@@ -72,11 +105,11 @@ metric_cb = CallbackData("change_metric", "city", "lat", "lon", "metric")
 details_cb = CallbackData("weather_details", "city", "lat", "lon")
 
 
-def lookup(s, lookups):
-    for pattern, value in lookups:
-        if re.search(pattern, s):
-            return value
-    return None
+def subscription_button(subscribed: bool):
+    return types.InlineKeyboardButton(
+        text="Daily forecast: {}".format("on" if subscribed else "off"),
+        callback_data="toggle_subscription",
+    )
 
 
 async def get_menu_buttons():
@@ -93,32 +126,58 @@ async def get_menu_buttons():
     return menu_buttons
 
 
-async def get_img_weather_url(city: str, weather: str, weather_id: str, metric: str):
-    weather_html = lookup(weather_id, WEATHER_ICONS_HTML)
-    if weather_html:
-        data = {
-            "html": weather_html.replace("\n", "").format(
-                city=city, weath=weather + " " + metric
-            ),
-            "css": CSS_WEATHER,
-            "google_fonts": "Roboto",
-        }
-    else:
-        logging.warning("Undefined weather code: ", weather_id)
+async def get_weather_card(city: str, weather: str, weather_id: str, metric: str):
+    """
+    Renders a weather card with the configured backend, going through
+    card_cache first. Returns {"key": ..., "url": ..., "png": ...}
+    where either url or png may be None.
+    """
+    icon = weather_icon(weather_id)
+    if icon is None:
+        logging.warning("Undefined weather code: %s", weather_id)
         return None
+    label = weather + " " + metric
+    key = CardCache.key(icon, city, label)
+    card = await card_cache.get(key)
+    if card is None:
+        card = await renderer.render(icon, city, label)
+        if card is None:
+            return None
+        await card_cache.set(key, card)
+    card["key"] = key
+    return card
+
+
+def card_photo(card: dict):
+    if card["url"]:
+        return card["url"]
+    bio = BytesIO(card["png"])
+    bio.name = "weather.png"
+    return bio
+
+
+def check_image(data: bytes):
+    """
+    Raises ValueError unless data is an image PIL can read, so an error page
+    served with the image URL is never cached as a card.
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url=HCTI_API_ENDPOINT,
-                data=data,
-                auth=aiohttp.BasicAuth(HCTI_API_USER_ID, HCTI_API_KEY),
-            ) as response:
-                return await response.json()
-    except:
-        return None
+        Image.open(BytesIO(data)).verify()
+    except Exception as e:
+        raise ValueError("Not an image ({} bytes): {}".format(len(data), e)) from e
+
+
+async def card_png(card: dict) -> bytes:
+    if card["png"] is None:
+        png = await http_client.read(card["url"], upstream="image")
+        check_image(png)
+        card["png"] = png
+        if "key" in card:
+            await card_cache.set(card["key"], card)
+    return card["png"]
 
 
-async def append_images(
+def concat_images(
     images, direction="horizontal", bg_color=(255, 255, 255), aligment="center"
 ):
     """
@@ -164,12 +223,61 @@ async def append_images(
     return new_im
 
 
-async def concat_imgs_by_urls(urls, bg_color):
-    imgs = []
-    for i in range(len(urls)):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url=urls[i]) as response:
-                buffer = BytesIO(await response.read())
-        img = Image.open(buffer)
-        imgs.append(img)
-    return await append_images(imgs, direction="horizontal", bg_color=bg_color)
+def decode_tile(png: bytes):
+    """
+    Fully decodes a card, or returns None if the bytes are not a readable
+    image (Image.open alone defers most errors to the paste).
+    """
+    try:
+        img = Image.open(BytesIO(png))
+        img.load()
+        return img
+    except Exception:
+        logging.warning("Undecodable forecast card (%d bytes)", len(png))
+        return None
+
+
+def compose_strip(pngs, bg_color):
+    """
+    Decodes card PNGs, stitches them horizontally and encodes the strip with
+    encode_image. None entries and cards that fail to decode become blank
+    placeholder tiles.
+    Runs in image_pool; returns (bytes, extension).
+    """
+    imgs = [decode_tile(png) if png else None for png in pngs]
+    size = next((img.size for img in imgs if img is not None), CARD_SIZE)
+    imgs = [img or Image.new("RGB", size, color=bg_color) for img in imgs]
+    return encode_image(concat_images(imgs, direction="horizontal", bg_color=bg_color))
+
+
+async def render_forecast(days: list, metric: str, bg_color):
+    """
+    Renders and fetches one card per forecast day concurrently, keeping the
+    day order, and returns (bytes, extension, placeholders). Days that fail
+    or time out become blank placeholder tiles, counted in placeholders.
+    """
+    semaphore = asyncio.Semaphore(FORECAST_CONCURRENCY)
+
+    async def render_day(day):
+        time = datetime.datetime.fromtimestamp(int(day.dt))
+        async with semaphore:
+            card = await get_weather_card(
+                weather=str(round(day.temp_day)),
+                city=f"{time:%Y-%m-%d}",
+                weather_id=str(day.weather_id),
+                metric=metric,
+            )
+            if card is None:
+                raise ValueError("No card rendered for {:%Y-%m-%d}".format(time))
+            return await card_png(card)
+
+    async def render_day_or_none(day):
+        try:
+            return await asyncio.wait_for(render_day(day), FORECAST_CARD_TIMEOUT)
+        except Exception:
+            logging.exception("Forecast card failed, using placeholder")
+            return None
+
+    pngs = await asyncio.gather(*(render_day_or_none(day) for day in days))
+    photo, ext = await image_pool.run(compose_strip, pngs, bg_color)
+    return photo, ext, pngs.count(None)
@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import json
+import logging
+from collections import Counter
+from io import BytesIO
+
+from aiogram.utils.exceptions import (
+    BotBlocked,
+    ChatNotFound,
+    RetryAfter,
+    TelegramAPIError,
+    UserDeactivated,
+)
+
+from config import (
+    BROADCAST_TIME,
+    BROADCAST_RATE,
+    BROADCAST_WORKERS,
+    BROADCAST_BATCH,
+    OWM_CACHE_GRID,
+)
+from db_utils import Database
+from limit_utils import RateLimiter
+from photo_utils import PhotoSender, photo_key
+from weather_service import WeatherRequest, WeatherService
+
+# sends that hit flood control are retried this many times
+MAX_RETRIES = 3
+# job_runs name; see Database.claim_run
+JOB_NAME = "daily_forecast"
+
+
+def next_run(at: str, now: datetime.datetime = None) -> datetime.datetime:
+    """
+    Next occurrence of the UTC time "HH:MM" after now.
+    """
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    hour, minute = map(int, at.split(":"))
+    run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if run <= now:
+        run += datetime.timedelta(days=1)
+    return run
+
+
+class ForecastBroadcaster:
+    """
+    Sends the daily forecast to every subscriber at BROADCAST_TIME.
+
+    Subscribers are streamed from a server-side cursor in forecast cells
+    (see Database.iter_subscribers), each cell is rendered once, and a
+    fixed set of workers fans the strip out at no more than
+    BROADCAST_RATE messages per second. After the first upload in a cell
+    the photo goes out by file_id. Memory use is bounded by the send queue,
+    not by the number of subscribers.
+
+    Each run is claimed in job_runs first, so with several replicas only
+    one of them sends.
+    """
+
+    def __init__(self, db: Database, service: WeatherService, photos: PhotoSender):
+        self.db = db
+        self.service = service
+        self.photos = photos
+        self.limiter = RateLimiter(BROADCAST_RATE)
+        self.stats = Counter()
+        self._task = None
+
+    def start(self):
+        if BROADCAST_TIME and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            run = next_run(BROADCAST_TIME)
+            now = datetime.datetime.now(datetime.timezone.utc)
+            await asyncio.sleep((run - now).total_seconds())
+            try:
+                # every replica wakes up; the one that claims the run sends
+                if await self.db.claim_run(JOB_NAME, run):
+                    await self.broadcast()
+                else:
+                    logging.info("Daily forecast for %s sent by another process", run)
+            except Exception:
+                logging.exception("Forecast broadcast failed")
+
+    async def groups(self):
+        """
+        Yields (WeatherRequest, [(chat_id, city), ...]) per forecast cell and
+        units, consuming the cursor one group at a time.
+        """
+        key, request, chats = None, None, []
+        async for row in self.db.iter_subscribers(
+            OWM_CACHE_GRID, prefetch=BROADCAST_BATCH
+        ):
+            try:
+                location = json.loads(row["location"])
+                row_request = WeatherRequest(
+                    lat=float(location["lat"]),
+                    lon=float(location["lon"]),
+                    units=row["weather_metric"],
+                    city=location.get("city"),
+                )
+            except (TypeError, ValueError, KeyError):
+                continue
+            row_key = self.service.forecast_key(row_request)
+            if row_key != key:
+                if chats:
+                    yield request, chats
+                key, request, chats = row_key, row_request, []
+            chats.append((row["telegram_id"], row_request.city))
+        if chats:
+            yield request, chats
+
+    async def broadcast(self):
+        self.stats.clear()
+        queue = asyncio.Queue(maxsize=BROADCAST_WORKERS * 4)
+        workers = [
+            asyncio.create_task(self._worker(queue)) for _ in range(BROADCAST_WORKERS)
+        ]
+        try:
+            async for request, chats in self.groups():
+                self.stats["groups"] += 1
+                try:
+                    forecast = await self.service.forecast(request, count=False)
+                except Exception:
+                    logging.exception("Could not render forecast for %s", request)
+                    self.stats["failed"] += len(chats)
+                    continue
+                key = photo_key(forecast.photo)
+                for chat_id, city in chats:
+                    await queue.put((chat_id, city, forecast, key))
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        logging.info("Daily forecast broadcast: %s", dict(self.stats))
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            chat_id, city, forecast, key = await queue.get()
+            try:
+                await self.send(chat_id, city, forecast, key)
+            except Exception:
+                logging.exception("Could not send daily forecast to %s", chat_id)
+                self.stats["failed"] += 1
+            finally:
+                queue.task_done()
+
+    async def send(self, chat_id: int, city: str, forecast, key: str):
+        caption = "*Daily forecast for {}*\n{}".format(
+            (city or forecast.timezone).replace("*", "\\*"), forecast.caption
+        )
+        for _ in range(MAX_RETRIES + 1):
+            await self.limiter.acquire()
+            bio = BytesIO(forecast.photo)
+            bio.name = "forecast." + forecast.ext
+            try:
+                await self.photos.send_photo(
+                    chat_id=chat_id,
+                    photo=bio,
+                    key=key,
+                    caption=caption,
+                    parse_mode="markdown",
+                )
+            except RetryAfter as e:
+                # flood control applies to the whole bot, so every worker waits
+                self.stats["retried"] += 1
+                self.limiter.pause(e.timeout)
+                continue
+            except (BotBlocked, UserDeactivated, ChatNotFound):
+                self.stats["unsubscribed"] += 1
+                await self.db.unsubscribe(chat_id)
+                return
+            except TelegramAPIError:
+                logging.exception("Could not send daily forecast to %s", chat_id)
+                self.stats["failed"] += 1
+                return
+            self.stats["sent"] += 1
+            return
+        self.stats["failed"] += 1
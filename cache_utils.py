@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    In-memory LRU cache with a size bound and per-entry TTL.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count: bool = True):
+        item = self._data.get(key)
+        if item is not None:
+            value, expires = item
+            if expires is None or expires > time.monotonic():
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            del self._data[key]
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else None
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class DiskCache:
+    """
+    Directory of <key>.png / <key>.url files. It only survives restarts on a
+    persistent filesystem; Heroku dynos start with an empty one.
+    File access runs in the default executor to keep the event loop free.
+
+    Files are written once and rarely read again after their day has passed,
+    so every sweep_interval seconds set() also deletes expired files and then
+    the oldest ones until the directory fits in max_bytes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = None,
+        max_bytes: int = None,
+        sweep_interval: float = 600,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._next_sweep = 0.0
+
+    def _file(self, key: str, ext: str):
+        return os.path.join(self.path, key + ext)
+
+    def _read(self, key: str):
+        card = {"url": None, "png": None}
+        for field, ext, mode in (("url", ".url", "r"), ("png", ".png", "rb")):
+            name = self._file(key, ext)
+            try:
+                if self.ttl and time.time() - os.path.getmtime(name) > self.ttl:
+                    os.remove(name)
+                    continue
+                with open(name, mode) as file:
+                    card[field] = file.read()
+            except FileNotFoundError:
+                continue
+        if card["url"] is None and card["png"] is None:
+            return None
+        return card
+
+    def _write(self, key: str, card: dict):
+        os.makedirs(self.path, exist_ok=True)
+        for field, ext, mode in (("url", ".url", "w"), ("png", ".png", "wb")):
+            if card.get(field) is None:
+                continue
+            name = self._file(key, ext)
+            tmp = name + ".tmp"
+            with open(tmp, mode) as file:
+                file.write(card[field])
+            os.replace(tmp, name)
+
+    def _sweep(self):
+        now = time.time()
+        files = []
+        try:
+            entries = list(os.scandir(self.path))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                stat = entry.stat()
+                if self.ttl and now - stat.st_mtime > self.ttl:
+                    os.remove(entry.path)
+                    self.evicted += 1
+                    continue
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        if not self.max_bytes:
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    async def get(self, key: str):
+        loop = asyncio.get_running_loop()
+        card = await loop.run_in_executor(None, self._read, key)
+        if card is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return card
+
+    async def set(self, key: str, card: dict):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write, key, card)
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            await loop.run_in_executor(None, self._sweep)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class PostgresCardStore:
+    """
+    Card tier in the card_cache table (see migrate.py), shared by every
+    process and kept across restarts and deploys. Sweeps like DiskCache:
+    expired rows first, then the oldest rows beyond max_bytes.
+    """
+
+    def __init__(
+        self,
+        db,
+        ttl: float = None,
+        max_bytes: int = None,
+        sweep_interval: float = 600,
+    ):
+        self.db = db
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self._next_sweep = 0.0
+
+    async def get(self, key: str):
+        row = await self.db.get_card(key, self.ttl)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"url": row["url"], "png": row["png"]}
+
+    async def set(self, key: str, card: dict):
+        await self.db.set_card(key, card.get("url"), card.get("png"))
+        if time.monotonic() >= self._next_sweep:
+            self._next_sweep = time.monotonic() + self.sweep_interval
+            self.evicted += await self.db.purge_cards(self.ttl, self.max_bytes)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evicted": self.evicted,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CardCache:
+    """
+    Two-tier cache of rendered weather cards ({"url": ..., "png": ...}),
+    content-addressed by a hash of everything that goes into a card. store
+    is a DiskCache, a PostgresCardStore or None for memory only.
+    """
+
+    def __init__(self, memory: LRUCache, store=None):
+        self.memory = memory
+        self.store = store
+
+    @staticmethod
+    def key(icon: str, city: str, weather: str) -> str:
+        return hashlib.sha256(
+            "\x1f".join((icon, city, weather)).encode("utf-8")
+        ).hexdigest()
+
+    async def get(self, key: str):
+        card = self.memory.get(key)
+        if card is None and self.store is not None:
+            card = await self.store.get(key)
+            if card is not None:
+                self.memory.set(key, card)
+        return card
+
+    async def set(self, key: str, card: dict):
+        self.memory.set(key, card)
+        if self.store is not None:
+            await self.store.set(key, card)
+
+    def stats(self):
+        stats = {"memory": self.memory.stats()}
+        if self.store is not None:
+            stats["store"] = self.store.stats()
+        return stats
+
+
+class SingleFlight:
+    """
+    De-duplicates concurrent calls: callers asking for the same key while
+    a call is in flight await the same future instead of starting another.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+
+    async def do(self, key, factory):
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await factory()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark retrieved so lone failures don't log "exception never retrieved"
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+
+class AsyncTTLCache:
+    """
+    LRUCache in front of a coroutine factory, with single-flight misses.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.flight = SingleFlight()
+
+    async def get_or_set(self, key, factory, ttl: float = None):
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        async def load():
+            value = await factory()
+            self.cache.set(key, value, ttl=ttl)
+            return value
+
+        return await self.flight.do(key, load)
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats["shared"] = self.flight.shared
+        return stats
@@ -8,7 +8,133 @@ DB_USERNAME = config("DB_USERNAME")
 DB_PASSWORD = config("DB_PASSWORD")
 
 OWM_TOKEN = config("OWM_TOKEN")
+# overridable to point the bot at local stand-ins (see benchmarks/loadtest.py)
+OWM_API_BASE = config("OWM_API_BASE", default="https://api.openweathermap.org")
+# empty for api.telegram.org, or the base URL of another Bot API server
+TELEGRAM_API_BASE = config("TELEGRAM_API_BASE", default="")
 
-HCTI_API_ENDPOINT = config("HCTI_API_ENDPOINT")
-HCTI_API_USER_ID = config("HCTI_API_USER_ID")
-HCTI_API_KEY = config("HCTI_API_KEY")
+# "local" draws cards in-process, "hcti" renders them through the HCTI API
+RENDER_BACKEND = config("RENDER_BACKEND", default="local")
+
+HCTI_API_ENDPOINT = config("HCTI_API_ENDPOINT", default="")
+HCTI_API_USER_ID = config("HCTI_API_USER_ID", default="")
+HCTI_API_KEY = config("HCTI_API_KEY", default="")
+# optional zip with templates/, staticfiles/ and sprites/ (python resources.py out.zip)
+RESOURCE_BUNDLE = config("RESOURCE_BUNDLE", default="")
+
+HTTP_POOL_LIMIT = config("HTTP_POOL_LIMIT", default=100, cast=int)
+HTTP_POOL_LIMIT_PER_HOST = config("HTTP_POOL_LIMIT_PER_HOST", default=20, cast=int)
+HTTP_KEEPALIVE_TIMEOUT = config("HTTP_KEEPALIVE_TIMEOUT", default=30, cast=float)
+HTTP_DNS_CACHE_TTL = config("HTTP_DNS_CACHE_TTL", default=300, cast=int)
+HTTP_CONNECT_TIMEOUT = config("HTTP_CONNECT_TIMEOUT", default=5, cast=float)
+HTTP_TOTAL_TIMEOUT = config("HTTP_TOTAL_TIMEOUT", default=30, cast=float)
+
+CARD_CACHE_SIZE = config("CARD_CACHE_SIZE", default=512, cast=int)
+CARD_CACHE_TTL = config("CARD_CACHE_TTL", default=24 * 60 * 60, cast=int)
+# second tier: "disk", "postgres" or "" for memory only; use "postgres" where
+# the filesystem does not outlive the process (e.g. Heroku dynos)
+CARD_CACHE_STORE = config("CARD_CACHE_STORE", default="disk")
+# empty value disables the on-disk tier
+CARD_CACHE_DIR = config("CARD_CACHE_DIR", default=".cache/cards")
+CARD_CACHE_STORE_TTL = config(
+    "CARD_CACHE_STORE_TTL", default=7 * 24 * 60 * 60, cast=int
+)
+CARD_CACHE_STORE_MAX_MB = config("CARD_CACHE_STORE_MAX_MB", default=256, cast=int)
+# expired and over-cap cards are swept at most this often, in seconds
+CARD_CACHE_SWEEP_INTERVAL = config("CARD_CACHE_SWEEP_INTERVAL", default=600, cast=int)
+
+FORECAST_CONCURRENCY = config("FORECAST_CONCURRENCY", default=7, cast=int)
+FORECAST_CARD_TIMEOUT = config("FORECAST_CARD_TIMEOUT", default=10, cast=float)
+
+# OWM responses are cached per grid cell of OWM_CACHE_GRID degrees
+OWM_CACHE_GRID = config("OWM_CACHE_GRID", default=0.01, cast=float)
+OWM_CACHE_SIZE = config("OWM_CACHE_SIZE", default=4096, cast=int)
+OWM_WEATHER_TTL = config("OWM_WEATHER_TTL", default=10 * 60, cast=int)
+OWM_ONECALL_TTL = config("OWM_ONECALL_TTL", default=60 * 60, cast=int)
+
+GEOCODE_CACHE_SIZE = config("GEOCODE_CACHE_SIZE", default=20000, cast=int)
+# optional path to OWM's city.list.json (plain or .gz) used as a local gazetteer
+CITY_LIST_PATH = config("CITY_LIST_PATH", default="")
+
+USER_CACHE_SIZE = config("USER_CACHE_SIZE", default=10000, cast=int)
+# the user-settings cache is per process: a change handled by one web dyno is
+# seen by the others only after this many seconds, so keep it short when
+# scaled out; a single polling worker can raise it safely
+USER_CACHE_TTL = config("USER_CACHE_TTL", default=30, cast=int)
+
+# asyncpg prepares and caches statements per connection
+DB_STATEMENT_CACHE_SIZE = config("DB_STATEMENT_CACHE_SIZE", default=100, cast=int)
+
+# "polling" for local development, "webhook" to serve updates over HTTP
+BOT_MODE = config("BOT_MODE", default="polling")
+# public https:// base URL; TLS is expected to terminate at the proxy in front
+WEBHOOK_HOST = config("WEBHOOK_HOST", default="")
+WEBHOOK_PATH = config("WEBHOOK_PATH", default="/webhook")
+# required in webhook mode: a random URL-safe string appended to WEBHOOK_PATH
+# so only Telegram knows where to post updates, e.g. `openssl rand -hex 32`
+WEBHOOK_SECRET = config("WEBHOOK_SECRET", default="")
+# behind Heroku's router the client address comes from X-Forwarded-For,
+# which anyone can set, so the secret path is what actually protects the hook
+WEBHOOK_CHECK_IP = config("WEBHOOK_CHECK_IP", default=False, cast=bool)
+WEBAPP_HOST = config("WEBAPP_HOST", default="0.0.0.0")
+WEBAPP_PORT = config("PORT", default=8080, cast=int)
+
+# "memory", "redis" or "postgres"
+FSM_STORAGE = config("FSM_STORAGE", default="memory")
+# abandoned conversation states expire after this many seconds
+FSM_STATE_TTL = config("FSM_STATE_TTL", default=24 * 60 * 60, cast=int)
+# seconds between deletions of expired rows with FSM_STORAGE=postgres; 0 disables
+FSM_PURGE_INTERVAL = config("FSM_PURGE_INTERVAL", default=60 * 60, cast=int)
+REDIS_HOST = config("REDIS_HOST", default="localhost")
+REDIS_PORT = config("REDIS_PORT", default=6379, cast=int)
+REDIS_DB = config("REDIS_DB", default=0, cast=int)
+REDIS_PASSWORD = config("REDIS_PASSWORD", default="")
+
+# "thread" or "process"; 0 workers means one per CPU
+IMAGE_POOL_KIND = config("IMAGE_POOL_KIND", default="thread")
+IMAGE_POOL_WORKERS = config("IMAGE_POOL_WORKERS", default=0, cast=int)
+IMAGE_POOL_QUEUE = config("IMAGE_POOL_QUEUE", default=32, cast=int)
+
+# forecast strip encoding: "auto", "png", "png-optimized", "png8", "jpeg" or "webp"
+IMAGE_FORMAT = config("IMAGE_FORMAT", default="auto")
+# candidates tried by "auto"; the smallest result wins
+IMAGE_AUTO_FORMATS = config("IMAGE_AUTO_FORMATS", default="png8,jpeg")
+IMAGE_JPEG_QUALITY = config("IMAGE_JPEG_QUALITY", default=85, cast=int)
+IMAGE_WEBP_QUALITY = config("IMAGE_WEBP_QUALITY", default=80, cast=int)
+IMAGE_PALETTE_COLORS = config("IMAGE_PALETTE_COLORS", default=64, cast=int)
+
+FILE_ID_CACHE_SIZE = config("FILE_ID_CACHE_SIZE", default=10000, cast=int)
+FILE_ID_CACHE_TTL = config("FILE_ID_CACHE_TTL", default=24 * 60 * 60, cast=int)
+
+FORECAST_CACHE_SIZE = config("FORECAST_CACHE_SIZE", default=2048, cast=int)
+FORECAST_CACHE_TTL = config("FORECAST_CACHE_TTL", default=60 * 60, cast=int)
+# strips with placeholder tiles are kept only this long, then re-rendered
+FORECAST_DEGRADED_TTL = config("FORECAST_DEGRADED_TTL", default=60, cast=int)
+# 0 disables the background forecast warmer
+WARMER_INTERVAL = config("WARMER_INTERVAL", default=30 * 60, cast=int)
+# one-call requests per second the warmer may spend from the OWM quota
+WARMER_RATE = config("WARMER_RATE", default=1, cast=float)
+
+# per-chat token bucket: sustained updates per second and burst size
+THROTTLE_RATE = config("THROTTLE_RATE", default=1, cast=float)
+THROTTLE_BURST = config("THROTTLE_BURST", default=5, cast=float)
+# updates that would wait longer than this for a token are rejected
+THROTTLE_MAX_WAIT = config("THROTTLE_MAX_WAIT", default=2, cast=float)
+# global caps on concurrent work; callers queue up to LIMIT_TIMEOUT seconds
+FORECAST_RENDER_LIMIT = config("FORECAST_RENDER_LIMIT", default=4, cast=int)
+HCTI_LIMIT = config("HCTI_LIMIT", default=4, cast=int)
+OWM_LIMIT = config("OWM_LIMIT", default=16, cast=int)
+LIMIT_TIMEOUT = config("LIMIT_TIMEOUT", default=15, cast=float)
+
+# polling mode serves /metrics on this port (0 disables); webhook mode
+# serves it on the webhook app
+METRICS_HOST = config("METRICS_HOST", default="0.0.0.0")
+METRICS_PORT = config("METRICS_PORT", default=9100, cast=int)
+
+# daily forecast for subscribers at this UTC time (HH:MM); empty disables
+BROADCAST_TIME = config("BROADCAST_TIME", default="07:00")
+# Telegram allows about 30 messages per second in total
+BROADCAST_RATE = config("BROADCAST_RATE", default=25, cast=float)
+BROADCAST_WORKERS = config("BROADCAST_WORKERS", default=8, cast=int)
+# subscriber rows fetched per cursor round trip
+BROADCAST_BATCH = config("BROADCAST_BATCH", default=500, cast=int)
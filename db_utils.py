@@ -1,61 +1,254 @@
-import asyncio
 import asyncpg
 
+import datetime
 import json
 
-from config import DB_NAME, DB_HOST, DB_USERNAME, DB_PASSWORD
+from cache_utils import LRUCache
+from metrics import TimedPool
+from config import (
+    DB_NAME,
+    DB_HOST,
+    DB_USERNAME,
+    DB_PASSWORD,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    DB_STATEMENT_CACHE_SIZE,
+)
 
 
 class Database:
-    def __init__(self, loop: asyncio.AbstractEventLoop):
-        self.pool = loop.run_until_complete(
-            asyncpg.create_pool(
-                database=DB_NAME,
-                user=DB_USERNAME,
-                password=DB_PASSWORD,
-                host=DB_HOST,
-                port="5432",
-            )
+    def __init__(self):
+        self.pool = None
+        # write-through cache of {"metric": ..., "location": ...} per user
+        self.user_cache = LRUCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+    async def connect(self):
+        pool = await asyncpg.create_pool(
+            database=DB_NAME,
+            user=DB_USERNAME,
+            password=DB_PASSWORD,
+            host=DB_HOST,
+            port="5432",
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
         )
+        self.pool = TimedPool(pool)
 
-    async def add_user(self, id: int):
-        await self.pool.execute("INSERT INTO users (telegram_id) VALUES ($1)", id)
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
 
-    async def current_user(self, id: int):
-        return await self.pool.fetchval(
-            "SELECT * FROM users WHERE telegram_id = $1", id
+    async def applied_migrations(self) -> set:
+        """
+        Names recorded in schema_migrations by migrate.py.
+        """
+        exists = await self.pool.fetchval(
+            "SELECT to_regclass('schema_migrations') IS NOT NULL"
+        )
+        if not exists:
+            return set()
+        rows = await self.pool.fetch("SELECT name FROM schema_migrations")
+        return {row["name"] for row in rows}
+
+    async def upsert_user(self, id: int):
+        """
+        Relies on the unique index on users.telegram_id (see migrate.py).
+        """
+        await self.pool.execute(
+            "INSERT INTO users (telegram_id) VALUES ($1) "
+            "ON CONFLICT (telegram_id) DO NOTHING",
+            id,
         )
 
     async def select_all_users(self):
         return await self.pool.fetch("SELECT * FROM users")
 
-    async def get_user_location(self, id: int):
-        return await self.pool.fetchval(
-            "SELECT location FROM users WHERE telegram_id = $1", id
+    async def select_saved_locations(self):
+        return await self.pool.fetch(
+            "SELECT DISTINCT location FROM users WHERE location IS NOT NULL"
         )
 
+    async def get_user_settings(self, id: int):
+        settings = self.user_cache.get(id)
+        if settings is None:
+            row = await self.pool.fetchrow(
+                "SELECT weather_metric, location, subscribed FROM users "
+                "WHERE telegram_id = $1",
+                id,
+            )
+            if row is None:
+                return None
+            settings = {
+                "metric": row["weather_metric"],
+                "location": row["location"],
+                "subscribed": row["subscribed"],
+            }
+            self.user_cache.set(id, settings)
+        return settings
+
+    async def get_user_location(self, id: int):
+        settings = await self.get_user_settings(id)
+        return settings and settings["location"]
+
     async def set_user_location(self, id: int, location: dict):
+        location = json.dumps(location)
         await self.pool.execute(
             "UPDATE users SET location = $1 WHERE telegram_id = $2",
-            json.dumps(location),
+            location,
             id,
         )
+        self._update_cached(id, location=location)
 
     async def get_user_metric(self, id: int):
-        return await self.pool.fetchval(
-            "SELECT weather_metric FROM users WHERE telegram_id = $1", id
+        settings = await self.get_user_settings(id)
+        return settings and settings["metric"]
+
+    async def toggle_metric(self, id: int):
+        """
+        Flips celsius <-> fahrenheit in one statement and returns the new value.
+        """
+        metric = await self.pool.fetchval(
+            "UPDATE users SET weather_metric = CASE weather_metric "
+            "WHEN 'celsius' THEN 'fahrenheit' ELSE 'celsius' END "
+            "WHERE telegram_id = $1 RETURNING weather_metric",
+            id,
         )
+        if metric is not None:
+            self._update_cached(id, metric=metric)
+        return metric
 
-    async def change_user_metric(self, id: int):
-        current_metric = await self.pool.fetchval(
-            "SELECT weather_metric FROM users WHERE telegram_id = $1", id
+    async def set_location_if_absent(self, id: int, location: dict):
+        """
+        Saves location only if the user has none yet; returns True if saved.
+        """
+        location = json.dumps(location)
+        saved = await self.pool.fetchval(
+            "UPDATE users SET location = $1 "
+            "WHERE telegram_id = $2 AND location IS NULL RETURNING true",
+            location,
+            id,
         )
-        if current_metric == "celsius":
-            return await self.pool.execute(
-                "UPDATE users SET weather_metric = 'fahrenheit' WHERE telegram_id = $1",
-                id,
+        if saved:
+            self._update_cached(id, location=location)
+        return bool(saved)
+
+    async def toggle_subscription(self, id: int):
+        """
+        Flips the daily forecast subscription and returns the new value.
+        """
+        subscribed = await self.pool.fetchval(
+            "UPDATE users SET subscribed = NOT subscribed "
+            "WHERE telegram_id = $1 RETURNING subscribed",
+            id,
+        )
+        if subscribed is not None:
+            self._update_cached(id, subscribed=subscribed)
+        return subscribed
+
+    async def unsubscribe(self, id: int):
+        await self.pool.execute(
+            "UPDATE users SET subscribed = false WHERE telegram_id = $1", id
+        )
+        self._update_cached(id, subscribed=False)
+
+    async def iter_subscribers(self, grid: float, prefetch: int = 500):
+        """
+        Streams (telegram_id, weather_metric, location) of subscribers with a
+        saved location through a server-side cursor, ordered so that users
+        in the same grid cell with the same units come out together. Cells
+        are computed like owm_utils.quantize: float8 round() also rounds
+        halves to even.
+        """
+        async with self.pool.acquire() as connection:
+            async with connection.transaction(readonly=True):
+                async for row in connection.cursor(
+                    "SELECT telegram_id, weather_metric, location FROM users "
+                    "WHERE subscribed AND location IS NOT NULL "
+                    "ORDER BY round((location::json->>'lat')::float8 / $1), "
+                    "round((location::json->>'lon')::float8 / $1), weather_metric",
+                    grid,
+                    prefetch=prefetch,
+                ):
+                    yield row
+
+    async def claim_run(self, name: str, period: datetime.datetime) -> bool:
+        """
+        Claims the run of background job name for period. Only one caller
+        across all processes gets True for a given period, so jobs like the
+        daily broadcast run once however many replicas are up.
+        """
+        claimed = await self.pool.fetchval(
+            "INSERT INTO job_runs (name, period) VALUES ($1, $2) "
+            "ON CONFLICT (name) DO UPDATE SET period = EXCLUDED.period, "
+            "claimed_at = now() WHERE job_runs.period < EXCLUDED.period "
+            "RETURNING true",
+            name,
+            period,
+        )
+        return bool(claimed)
+
+    def _update_cached(self, id: int, **fields):
+        settings = self.user_cache.get(id, count=False)
+        if settings is not None:
+            self.user_cache.set(id, {**settings, **fields})
+
+    async def select_all_cities(self):
+        return await self.pool.fetch("SELECT query, name, lat, lon FROM cities")
+
+    async def get_city(self, query: str):
+        return await self.pool.fetchrow(
+            "SELECT name, lat, lon FROM cities WHERE query = $1", query
+        )
+
+    async def add_city(self, query: str, name: str, lat: float, lon: float):
+        await self.pool.execute(
+            "INSERT INTO cities (query, name, lat, lon) VALUES ($1, $2, $3, $4) "
+            "ON CONFLICT (query) DO NOTHING",
+            query,
+            name,
+            lat,
+            lon,
+        )
+
+    async def get_card(self, key: str, ttl: float = None):
+        return await self.pool.fetchrow(
+            "SELECT url, png FROM card_cache WHERE key = $1 "
+            "AND ($2::float8 IS NULL OR created_at >= now() - make_interval(secs => $2))",
+            key,
+            ttl,
+        )
+
+    async def set_card(self, key: str, url: str, png: bytes):
+        await self.pool.execute(
+            "INSERT INTO card_cache (key, url, png) VALUES ($1, $2, $3) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "url = EXCLUDED.url, png = EXCLUDED.png, created_at = now()",
+            key,
+            url,
+            png,
+        )
+
+    async def purge_cards(self, ttl: float = None, max_bytes: int = None) -> int:
+        """
+        Deletes expired cards, then the oldest ones beyond max_bytes in
+        total; returns how many rows went.
+        """
+        deleted = 0
+        if ttl:
+            result = await self.pool.execute(
+                "DELETE FROM card_cache "
+                "WHERE created_at < now() - make_interval(secs => $1)",
+                ttl,
             )
-        elif current_metric == "fahrenheit":
-            return await self.pool.execute(
-                "UPDATE users SET weather_metric = 'celsius' WHERE telegram_id = $1", id
+            deleted += int(result.split()[-1])
+        if max_bytes:
+            result = await self.pool.execute(
+                "DELETE FROM card_cache WHERE key IN ("
+                "SELECT key FROM (SELECT key, sum("
+                "coalesce(octet_length(png), 0) + coalesce(octet_length(url), 0)"
+                ") OVER (ORDER BY created_at DESC, key) AS total FROM card_cache"
+                ") AS sized WHERE total > $1)",
+                max_bytes,
             )
+            deleted += int(result.split()[-1])
+        return deleted
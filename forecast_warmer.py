@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+
+from bot_utils import WEATHER_UNITS
+from config import WARMER_INTERVAL, WARMER_RATE
+from db_utils import Database
+from limit_utils import RateLimiter
+from weather_service import WeatherRequest, WeatherService
+
+# job_runs name; see Database.claim_run
+JOB_NAME = "forecast_warmer"
+
+
+class ForecastWarmer:
+    """
+    Periodically pre-renders forecast strips for every saved location so
+    "Weather forecast" -> "Current location" is served from cache.
+
+    Saved locations are clustered into the forecast cache cells, and each
+    cell is fetched and rendered once per units setting, at most
+    WARMER_RATE one-call requests per second.
+
+    Only the replica that claims a period in job_runs warms it, so the OWM
+    quota is spent once; the other replicas' caches fill on demand.
+    """
+
+    def __init__(self, db: Database, service: WeatherService):
+        self.db = db
+        self.service = service
+        self.limiter = RateLimiter(WARMER_RATE)
+        self._task = None
+
+    def start(self):
+        if WARMER_INTERVAL and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            # periods are aligned to WARMER_INTERVAL so every replica agrees
+            start = time.time() // WARMER_INTERVAL * WARMER_INTERVAL
+            period = datetime.datetime.fromtimestamp(start, datetime.timezone.utc)
+            try:
+                if await self.db.claim_run(JOB_NAME, period):
+                    await self.warm()
+            except Exception:
+                logging.exception("Forecast warmer failed")
+            await asyncio.sleep(start + WARMER_INTERVAL - time.time())
+
+    async def clusters(self):
+        cells = {}
+        for row in await self.db.select_saved_locations():
+            try:
+                location = json.loads(row["location"])
+                request = WeatherRequest(
+                    lat=float(location["lat"]),
+                    lon=float(location["lon"]),
+                    units="celsius",
+                )
+            except (TypeError, ValueError, KeyError):
+                continue
+            cells.setdefault(self.service.forecast_key(request)[:2], request)
+        return list(cells.values())
+
+    async def warm(self):
+        requests = await self.clusters()
+        for request in requests:
+            for units in WEATHER_UNITS:
+                await self.limiter.acquire()
+                request = WeatherRequest(lat=request.lat, lon=request.lon, units=units)
+                try:
+                    await self.service.forecast(request, warm=True)
+                except Exception:
+                    logging.exception("Could not warm forecast for %s", request)
+        logging.info(
+            "Warmed %d forecast cells, warm-hit ratio %.2f, %d renders coalesced",
+            len(requests),
+            self.service.warm_hit_ratio(),
+            self.service.renders_saved,
+        )
@@ -0,0 +1,106 @@
+import asyncio
+import gzip
+import json
+import logging
+import re
+import unicodedata
+
+from config import OWM_TOKEN, GEOCODE_CACHE_SIZE, CITY_LIST_PATH
+from bot_utils import OWM_API_URL_FIND
+from cache_utils import LRUCache, SingleFlight
+from db_utils import Database
+from http_utils import http_client
+
+
+def normalize_city(name: str) -> str:
+    """
+    "  São   Paulo " -> "sao paulo", "Kyiv , UA" -> "kyiv,ua"
+    """
+    name = unicodedata.normalize("NFKD", name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = re.sub(r"\s+", " ", name.casefold()).strip()
+    return re.sub(r"\s*,\s*", ",", name)
+
+
+def load_city_list(path: str) -> dict:
+    """
+    Builds a normalized name -> city index from OWM's city.list.json.
+    Cities are indexed both as "name" and "name,country"; the first entry
+    wins for ambiguous names.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as file:
+        entries = json.load(file)
+    index = {}
+    for entry in entries:
+        city = {
+            "name": entry["name"],
+            "lat": entry["coord"]["lat"],
+            "lon": entry["coord"]["lon"],
+        }
+        name = normalize_city(entry["name"])
+        index.setdefault(name, city)
+        if entry.get("country"):
+            index.setdefault(name + "," + entry["country"].casefold(), city)
+    return index
+
+
+class Geocoder:
+    """
+    Resolves free-text city names to {"name", "lat", "lon"}.
+    Lookup order: memory, local gazetteer, cities table, OWM find.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.memory = LRUCache(maxsize=GEOCODE_CACHE_SIZE)
+        self.gazetteer = {}
+        self.flight = SingleFlight()
+
+    async def warm(self):
+        for row in await self.db.select_all_cities():
+            self.memory.set(
+                row["query"],
+                {"name": row["name"], "lat": row["lat"], "lon": row["lon"]},
+            )
+        if CITY_LIST_PATH:
+            loop = asyncio.get_running_loop()
+            self.gazetteer = await loop.run_in_executor(
+                None, load_city_list, CITY_LIST_PATH
+            )
+        logging.info(
+            "Geocoder warmed: %s cached, %s in gazetteer",
+            len(self.memory),
+            len(self.gazetteer),
+        )
+
+    async def lookup(self, name: str):
+        query = normalize_city(name)
+        if not query:
+            return None
+        city = self.memory.get(query) or self.gazetteer.get(query)
+        if city is None:
+            city = await self.flight.do(query, lambda: self._resolve(query, name))
+        if city is not None:
+            self.memory.set(query, city)
+        return city
+
+    async def _resolve(self, query: str, name: str):
+        row = await self.db.get_city(query)
+        if row:
+            return {"name": row["name"], "lat": row["lat"], "lon": row["lon"]}
+
+        params = {"q": name, "type": "like", "APPID": OWM_TOKEN}
+        r = await http_client.get_json(
+            url=OWM_API_URL_FIND, params=params, upstream="owm_find"
+        )
+        if not r.get("list"):
+            return None
+        found = r["list"][0]
+        city = {
+            "name": found["name"],
+            "lat": found["coord"]["lat"],
+            "lon": found["coord"]["lon"],
+        }
+        await self.db.add_city(query, city["name"], city["lat"], city["lon"])
+        return city
@@ -0,0 +1,96 @@
+import json
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from config import (
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_DNS_CACHE_TTL,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_TOTAL_TIMEOUT,
+)
+from metrics import upstream_seconds, upstream_errors, upstream_bytes
+
+
+class HttpClient:
+    """
+    One long-lived aiohttp session shared by every outbound call, so
+    OWM, HCTI and image requests reuse pooled keep-alive connections
+    instead of paying DNS, TCP and TLS setup on each request.
+
+    Every call is timed into the upstream metrics under its upstream name;
+    error statuses raise aiohttp.ClientResponseError.
+    """
+
+    def __init__(self):
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def start(self):
+        return self.session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @asynccontextmanager
+    async def _observe(self, upstream: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            upstream_errors.inc(upstream)
+            raise
+        finally:
+            upstream_seconds.observe(time.perf_counter() - start, upstream)
+
+    def _check(self, response: aiohttp.ClientResponse):
+        # raising lets _observe count the failed call, and only once
+        response.raise_for_status()
+
+    async def get_json(
+        self, url: str, params: dict = None, loads=json.loads, upstream: str = "other"
+    ):
+        async with self._observe(upstream):
+            async with self.session.get(url=url, params=params) as response:
+                self._check(response)
+                return await response.json(loads=loads)
+
+    async def post_json(
+        self, url: str, data: dict = None, auth=None, upstream: str = "other"
+    ):
+        async with self._observe(upstream):
+            async with self.session.post(url=url, data=data, auth=auth) as response:
+                self._check(response)
+                return await response.json()
+
+    async def read(
+        self, url: str, params: dict = None, upstream: str = "other"
+    ) -> bytes:
+        async with self._observe(upstream):
+            async with self.session.get(url=url, params=params) as response:
+                self._check(response)
+                body = await response.read()
+        upstream_bytes.inc(upstream, value=len(body))
+        return body
+
+
+http_client = HttpClient()
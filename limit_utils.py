@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from cache_utils import LRUCache
+from config import (
+    THROTTLE_RATE,
+    THROTTLE_BURST,
+    THROTTLE_MAX_WAIT,
+    FORECAST_RENDER_LIMIT,
+    HCTI_LIMIT,
+    OWM_LIMIT,
+    LIMIT_TIMEOUT,
+)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: rate tokens per second, up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, tokens: float = 1) -> bool:
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1) -> float:
+        """
+        Seconds until tokens will be available.
+        """
+        self._refill()
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Takes tokens even if they are not there yet, going into debt, and
+        returns the seconds to wait before using them.
+        """
+        delay = self.delay(tokens)
+        self.tokens -= tokens
+        return delay
+
+
+class RateLimiter:
+    """
+    Awaitable token bucket: acquire() sleeps until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.bucket = TokenBucket(rate, capacity)
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """
+        Holds every acquirer back for at least seconds, e.g. after a 429.
+        """
+        self.bucket._refill()
+        self.bucket.tokens = min(self.bucket.tokens, -seconds * self.bucket.rate)
+
+    async def acquire(self, tokens: float = 1):
+        async with self._lock:
+            while not self.bucket.consume(tokens):
+                await asyncio.sleep(self.bucket.delay(tokens))
+
+
+class Overloaded(Exception):
+    """
+    Raised when a ConcurrencyLimit slot does not free up in time.
+    """
+
+    def __init__(self, name: str):
+        super().__init__("{} is overloaded".format(name))
+        self.name = name
+
+
+class ConcurrencyLimit:
+    """
+    Caps concurrent work of one kind. Callers queue for a slot for up to
+    timeout seconds, then get Overloaded.
+    """
+
+    def __init__(self, name: str, limit: int, timeout: float = None):
+        self.name = name
+        self.limit = limit
+        self.timeout = timeout
+        self.active = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __aenter__(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(self.name) from None
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self._semaphore.release()
+
+
+forecast_limit = ConcurrencyLimit("forecast", FORECAST_RENDER_LIMIT, LIMIT_TIMEOUT)
+hcti_limit = ConcurrencyLimit("hcti", HCTI_LIMIT, LIMIT_TIMEOUT)
+owm_limit = ConcurrencyLimit("owm", OWM_LIMIT, LIMIT_TIMEOUT)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Per-chat token bucket over incoming messages and callback queries.
+    An update short of a token waits for it if that takes at most max_wait
+    seconds, otherwise it is dropped with a short notice (at most one
+    notice per chat until its bucket refills).
+    """
+
+    text = "Too many requests, please wait a few seconds and try again."
+
+    def __init__(
+        self,
+        rate: float = THROTTLE_RATE,
+        burst: float = THROTTLE_BURST,
+        max_wait: float = THROTTLE_MAX_WAIT,
+    ):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.rejected = 0
+        # idle buckets are full again after burst / rate seconds
+        self.buckets = LRUCache(maxsize=10000, ttl=burst / rate)
+        self.warned = LRUCache(maxsize=10000, ttl=burst / rate)
+
+    async def _throttle(self, chat_id: int, notify):
+        bucket = self.buckets.get(chat_id, count=False)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        self.buckets.set(chat_id, bucket)
+        if bucket.delay() > self.max_wait:
+            self.rejected += 1
+            if self.warned.get(chat_id, count=False) is None:
+                self.warned.set(chat_id, True)
+                await notify()
+            raise CancelHandler()
+        delay = bucket.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        await self._throttle(message.chat.id, lambda: message.answer(self.text))
+
+    async def on_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        await self._throttle(
+            query.message.chat.id if query.message else query.from_user.id,
+            lambda: query.answer(self.text),
+        )
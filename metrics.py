@@ -0,0 +1,299 @@
+import bisect
+import logging
+import re
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+# seconds; covers cached replies (ms) up to slow renders and timeouts
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Registry:
+    """
+    Collects metrics and renders them in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logging.exception("Could not collect metric %s", metric.name)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        registry.register(self)
+
+    def inc(self, *labels, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        yield "# HELP {} {}".format(self.name, self.doc)
+        yield "# TYPE {} counter".format(self.name)
+        for labels, value in self._values.items():
+            yield "{}{} {}".format(self.name, _labels(self.labels, labels), value)
+
+
+class Histogram:
+    """
+    Stores per-bucket counts only; cumulative counts are built on render,
+    so observe() is a bisect and three additions.
+    """
+
+    def __init__(self, name: str, doc: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts + overflow, sum]
+        self._values = {}
+        registry.register(self)
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        yield "# HELP {} {}".format(self.name, self.doc)
+        yield "# TYPE {} histogram".format(self.name)
+        names = self.labels + ("le",)
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield "{}_bucket{} {}".format(
+                    self.name, _labels(names, labels + (bound,)), cumulative
+                )
+            suffix = _labels(self.labels, labels)
+            yield "{}_sum{} {}".format(self.name, suffix, total)
+            yield "{}_count{} {}".format(self.name, suffix, cumulative)
+
+
+class GaugeFunc:
+    """
+    Gauge read on scrape from func(), which returns either a number or a
+    dict of label value tuples to numbers.
+    """
+
+    def __init__(self, name: str, doc: str, func, labels=()):
+        self.name = name
+        self.doc = doc
+        self.func = func
+        self.labels = tuple(labels)
+        registry.register(self)
+
+    def render(self):
+        yield "# HELP {} {}".format(self.name, self.doc)
+        yield "# TYPE {} gauge".format(self.name)
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, value in values.items():
+            yield "{}{} {}".format(self.name, _labels(self.labels, labels), value)
+
+
+handler_seconds = Histogram(
+    "bot_handler_seconds", "Time spent in update handlers.", ["handler"]
+)
+upstream_seconds = Histogram(
+    "bot_upstream_seconds", "Outbound HTTP call latency.", ["upstream"]
+)
+upstream_errors = Counter(
+    "bot_upstream_errors_total",
+    "Outbound HTTP calls that failed or returned an error status.",
+    ["upstream"],
+)
+# calls per upstream are the _count of upstream_seconds
+upstream_bytes = Counter(
+    "bot_upstream_bytes_total",
+    "Response body bytes read from outbound HTTP calls.",
+    ["upstream"],
+)
+db_query_seconds = Histogram(
+    "bot_db_query_seconds", "Database query latency.", ["query"]
+)
+# forecast is observed per render; cache hits return before the hook runs
+service_seconds = Histogram(
+    "bot_weather_service_seconds",
+    "WeatherService latency by product and outcome.",
+    ["product", "outcome"],
+)
+
+
+def observe_service(product: str, seconds: float, error):
+    """
+    WeatherService hook feeding service_seconds.
+    """
+    service_seconds.observe(seconds, product, "error" if error else "ok")
+
+
+class CacheStats:
+    """
+    Exposes stats() of the registered caches as hits, misses, size and
+    hit rate gauges labelled by cache name.
+    """
+
+    FIELDS = ("hits", "misses", "size", "hit_rate")
+
+    def __init__(self):
+        self.caches = {}
+        for field in self.FIELDS:
+            GaugeFunc(
+                "bot_cache_" + field,
+                "Cache {} by cache.".format(field.replace("_", " ")),
+                lambda field=field: self.collect(field),
+                ["cache"],
+            )
+
+    def add(self, name: str, stats):
+        self.caches[name] = stats
+
+    def collect(self, field: str):
+        values = {}
+        for name, stats in self.caches.items():
+            value = stats().get(field)
+            if value is not None:
+                values[(name,)] = value
+        return values
+
+
+cache_stats = CacheStats()
+
+
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|EXISTS)\s+(\w+)", re.IGNORECASE)
+_labels_by_query = {}
+
+
+def query_label(query: str) -> str:
+    """
+    Short, low-cardinality label for a statement, e.g. "select users".
+    """
+    label = _labels_by_query.get(query)
+    if label is None:
+        verb = query.split(None, 1)[0].lower()
+        table = _TABLE.search(query)
+        label = verb + " " + table.group(1) if table else verb
+        _labels_by_query[query] = label
+    return label
+
+
+class TimedPool:
+    """
+    Wraps an asyncpg pool, timing execute and fetch* calls by query_label.
+    """
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    async def execute(self, query: str, *args, **kwargs):
+        with db_query_seconds.time(query_label(query)):
+            return await self._pool.execute(query, *args, **kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        with db_query_seconds.time(query_label(query)):
+            return await self._pool.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        with db_query_seconds.time(query_label(query)):
+            return await self._pool.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        with db_query_seconds.time(query_label(query)):
+            return await self._pool.fetchval(query, *args, **kwargs)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """
+    Records handler latency into handler_seconds, labelled by the name of
+    the handler function that processed the update.
+    """
+
+    def _start(self, data: dict):
+        data["_metrics_handler"] = current_handler.get().__name__
+        data["_metrics_start"] = time.perf_counter()
+
+    def _stop(self, data: dict):
+        start = data.get("_metrics_start")
+        if start is not None:
+            handler_seconds.observe(
+                time.perf_counter() - start, data["_metrics_handler"]
+            )
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._start(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data):
+        self._stop(data)
+
+    async def on_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        self._start(data)
+
+    async def on_post_process_callback_query(
+        self, query: types.CallbackQuery, results, data: dict
+    ):
+        self._stop(data)
+
+
+async def metrics_view(request: web.Request):
+    return web.Response(
+        text=registry.render(), content_type="text/plain", charset="utf-8"
+    )
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    """
+    Serves /metrics on its own port, for polling mode where the bot has no
+    web app of its own.
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,140 @@
+"""
+Schema changes, each applied once and recorded in schema_migrations.
+Run before starting the bot; the Procfile's release phase does this:
+
+    python migrate.py
+"""
+
+import asyncio
+import logging
+
+from db_utils import Database
+
+# only one migrate.py may run at a time, across every process
+MIGRATION_LOCK = 0x6D696772
+# fail instead of queueing every users query behind a blocked ALTER
+LOCK_TIMEOUT = "10s"
+
+# (name, statements); append new entries, never edit applied ones
+MIGRATIONS = [
+    (
+        "users_telegram_id_unique",
+        [
+            # upsert_user's ON CONFLICT (telegram_id) needs this; fails if
+            # duplicate telegram_ids already exist, which must be merged by hand
+            "CREATE UNIQUE INDEX IF NOT EXISTS users_telegram_id_key "
+            "ON users (telegram_id)",
+        ],
+    ),
+    (
+        "card_cache",
+        [
+            "CREATE TABLE IF NOT EXISTS card_cache ("
+            "key text PRIMARY KEY, "
+            "url text, "
+            "png bytea, "
+            "created_at timestamptz NOT NULL DEFAULT now())",
+            "CREATE INDEX IF NOT EXISTS card_cache_created_at_idx "
+            "ON card_cache (created_at)",
+        ],
+    ),
+    (
+        "users_subscribed",
+        [
+            "ALTER TABLE users "
+            "ADD COLUMN IF NOT EXISTS subscribed boolean NOT NULL DEFAULT false",
+            "CREATE INDEX IF NOT EXISTS users_subscribed_idx "
+            "ON users (telegram_id) WHERE subscribed",
+        ],
+    ),
+    (
+        "job_runs",
+        [
+            # one row per background job; see Database.claim_run
+            "CREATE TABLE IF NOT EXISTS job_runs ("
+            "name text PRIMARY KEY, "
+            "period timestamptz NOT NULL, "
+            "claimed_at timestamptz NOT NULL DEFAULT now())",
+        ],
+    ),
+    (
+        "cities",
+        [
+            # geocoder results; existing deployments created it at startup
+            "CREATE TABLE IF NOT EXISTS cities ("
+            "query text PRIMARY KEY, "
+            "name text NOT NULL, "
+            "lat double precision NOT NULL, "
+            "lon double precision NOT NULL)",
+        ],
+    ),
+    (
+        "fsm_states",
+        [
+            # PostgresStorage; existing deployments created it at startup
+            "CREATE TABLE IF NOT EXISTS fsm_states ("
+            "chat bigint NOT NULL, "
+            '"user" bigint NOT NULL, '
+            "state text, "
+            "data jsonb NOT NULL DEFAULT '{}', "
+            "bucket jsonb NOT NULL DEFAULT '{}', "
+            "updated_at timestamptz NOT NULL DEFAULT now(), "
+            'PRIMARY KEY (chat, "user"))',
+        ],
+    ),
+]
+
+
+async def pending(db: Database) -> list:
+    """
+    Names of migrations not applied yet; cheap enough for every startup.
+    """
+    done = await db.applied_migrations()
+    return [name for name, _ in MIGRATIONS if name not in done]
+
+
+async def migrate(db: Database) -> list:
+    """
+    Applies pending migrations in one transaction and returns their names.
+    """
+    async with db.pool.acquire() as connection:
+        async with connection.transaction():
+            await connection.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK)
+            await connection.execute(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "name text PRIMARY KEY, "
+                "applied_at timestamptz NOT NULL DEFAULT now())"
+            )
+            await connection.execute(
+                "SET LOCAL lock_timeout = '{}'".format(LOCK_TIMEOUT)
+            )
+            done = {
+                row["name"]
+                for row in await connection.fetch("SELECT name FROM schema_migrations")
+            }
+            names = []
+            for name, statements in MIGRATIONS:
+                if name in done:
+                    continue
+                for statement in statements:
+                    await connection.execute(statement)
+                await connection.execute(
+                    "INSERT INTO schema_migrations (name) VALUES ($1)", name
+                )
+                names.append(name)
+    return names
+
+
+async def main():
+    db = Database()
+    await db.connect()
+    try:
+        names = await migrate(db)
+    finally:
+        await db.close()
+    logging.info("Applied migrations: %s", ", ".join(names) or "none")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+"""
+Compact views of OWM payloads that keep only the fields the bot uses.
+"""
+
+from dataclasses import dataclass
+from typing import List, Optional
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    import json
+
+    loads = json.loads
+
+
+@dataclass
+class CurrentWeather:
+    __slots__ = (
+        "name",
+        "lat",
+        "lon",
+        "temp",
+        "feels_like",
+        "weather_id",
+        "description",
+        "pressure",
+        "humidity",
+        "uvi",
+        "wind_speed",
+    )
+    name: Optional[str]
+    lat: Optional[float]
+    lon: Optional[float]
+    temp: float
+    feels_like: float
+    weather_id: int
+    description: str
+    pressure: int
+    humidity: int
+    uvi: Optional[float]
+    wind_speed: float
+
+
+@dataclass
+class DailyForecast:
+    __slots__ = ("dt", "temp_day", "weather_id")
+    dt: int
+    temp_day: float
+    weather_id: int
+
+
+@dataclass
+class Alert:
+    __slots__ = ("start", "end", "description")
+    start: int
+    end: int
+    description: str
+
+
+@dataclass
+class OneCall:
+    __slots__ = ("timezone", "current", "daily", "alerts")
+    timezone: str
+    current: Optional[CurrentWeather]
+    daily: List[DailyForecast]
+    alerts: List[Alert]
+
+
+def parse_weather(payload: dict) -> CurrentWeather:
+    """
+    Parses a /weather response.
+    """
+    main = payload["main"]
+    return CurrentWeather(
+        name=payload["name"],
+        lat=payload["coord"]["lat"],
+        lon=payload["coord"]["lon"],
+        temp=main["temp"],
+        feels_like=main["feels_like"],
+        weather_id=payload["weather"][0]["id"],
+        description=payload["weather"][0]["description"],
+        pressure=main["pressure"],
+        humidity=main["humidity"],
+        uvi=None,
+        wind_speed=payload.get("wind", {}).get("speed", 0.0),
+    )
+
+
+def parse_onecall(payload: dict) -> OneCall:
+    """
+    Parses a /onecall response; absent blocks become None or empty lists.
+    """
+    current = None
+    if "current" in payload:
+        c = payload["current"]
+        current = CurrentWeather(
+            name=None,
+            lat=payload.get("lat"),
+            lon=payload.get("lon"),
+            temp=c["temp"],
+            feels_like=c["feels_like"],
+            weather_id=c["weather"][0]["id"],
+            description=c["weather"][0]["description"],
+            pressure=c["pressure"],
+            humidity=c["humidity"],
+            uvi=c.get("uvi", 0.0),
+            wind_speed=c["wind_speed"],
+        )
+    daily = [
+        DailyForecast(
+            dt=day["dt"],
+            temp_day=day["temp"]["day"],
+            weather_id=day["weather"][0]["id"],
+        )
+        for day in payload.get("daily", ())
+    ]
+    alerts = [
+        Alert(start=alert["start"], end=alert["end"], description=alert["description"])
+        for alert in payload.get("alerts", ())
+    ]
+    return OneCall(
+        timezone=payload.get("timezone"), current=current, daily=daily, alerts=alerts
+    )
@@ -0,0 +1,122 @@
+import logging
+
+import aiohttp
+
+from config import (
+    OWM_TOKEN,
+    OWM_CACHE_GRID,
+    OWM_CACHE_SIZE,
+    OWM_WEATHER_TTL,
+    OWM_ONECALL_TTL,
+)
+from bot_utils import OWM_API_URL_WEATHER, OWM_API_ONECALL_URL_FORECAST
+from cache_utils import AsyncTTLCache
+from http_utils import http_client
+from limit_utils import owm_limit
+from models import loads, parse_weather, parse_onecall
+
+
+class OwmError(Exception):
+    """
+    OWM refused a request, with an error status or a "cod" in the body.
+    """
+
+
+ONECALL_PARTS = ("current", "minutely", "hourly", "daily", "alerts")
+
+ALLOWED_PARAMS = {
+    OWM_API_URL_WEATHER: {"lat", "lon", "units", "appid", "lang"},
+    OWM_API_ONECALL_URL_FORECAST: {"lat", "lon", "units", "appid", "lang", "exclude"},
+}
+
+UPSTREAMS = {
+    OWM_API_URL_WEATHER: "owm_weather",
+    OWM_API_ONECALL_URL_FORECAST: "owm_onecall",
+}
+
+
+def onecall_exclude(parts) -> str:
+    """
+    Turns the one-call blocks a product needs into the exclude parameter,
+    e.g. ("daily", "alerts") -> "current,minutely,hourly".
+    """
+    unknown = set(parts) - set(ONECALL_PARTS)
+    if unknown:
+        raise ValueError(
+            "Unknown one-call parts: {}".format(", ".join(sorted(unknown)))
+        )
+    return ",".join(part for part in ONECALL_PARTS if part not in parts)
+
+
+def build_params(url: str, **params) -> dict:
+    unknown = set(params) - ALLOWED_PARAMS[url]
+    if unknown:
+        raise ValueError(
+            "Unknown parameters for {}: {}".format(url, ", ".join(sorted(unknown)))
+        )
+    return params
+
+
+owm_cache = AsyncTTLCache(maxsize=OWM_CACHE_SIZE)
+
+
+def quantize(value, grid: float = OWM_CACHE_GRID) -> float:
+    """
+    Snaps a coordinate to the cache grid so nearby requests share a key.
+    """
+    return round(round(float(value) / grid) * grid, 6)
+
+
+def is_ok(response) -> bool:
+    """
+    OWM reports errors in the body ({"cod": "404", "message": ...}).
+    """
+    return "cod" not in response or str(response["cod"]) == "200"
+
+
+async def _cached_get(url: str, parse, lat, lon, units: str, ttl: int, **extra):
+    """
+    Fetches and parses an OWM endpoint through owm_cache; only the parsed
+    model is cached. Errors reported by OWM raise OwmError and are not
+    cached; network errors and timeouts propagate from http_client.
+    """
+    lat, lon = quantize(lat), quantize(lon)
+    key = (url, lat, lon, units) + tuple(sorted(extra.items()))
+    params = build_params(url, lat=lat, lon=lon, units=units, appid=OWM_TOKEN, **extra)
+
+    async def fetch():
+        try:
+            async with owm_limit:
+                body = await http_client.read(
+                    url, params=params, upstream=UPSTREAMS[url]
+                )
+        except aiohttp.ClientResponseError as e:
+            raise OwmError("{} {}".format(e.status, e.message)) from e
+        logging.info("OWM %s: %d bytes (%s)", url, len(body), extra or "-")
+        r = loads(body)
+        if not is_ok(r):
+            raise OwmError(r.get("message", r["cod"]))
+        return parse(r)
+
+    return await owm_cache.get_or_set(key, fetch, ttl=ttl)
+
+
+async def get_current_weather(lat, lon, units: str):
+    return await _cached_get(
+        OWM_API_URL_WEATHER, parse_weather, lat, lon, units, OWM_WEATHER_TTL
+    )
+
+
+async def get_onecall(lat, lon, units: str, parts):
+    """
+    parts: the one-call blocks to keep, see ONECALL_PARTS.
+    """
+    return await _cached_get(
+        OWM_API_ONECALL_URL_FORECAST,
+        parse_onecall,
+        lat,
+        lon,
+        units,
+        OWM_ONECALL_TTL,
+        exclude=onecall_exclude(parts),
+    )
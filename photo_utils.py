@@ -0,0 +1,60 @@
+import hashlib
+import logging
+from io import BytesIO
+
+from aiogram import Bot
+from aiogram.utils.exceptions import (
+    TypeOfFileMismatch,
+    WrongFileIdentifier,
+    WrongRemoteFileIdSpecified,
+)
+
+from cache_utils import LRUCache
+from config import FILE_ID_CACHE_SIZE, FILE_ID_CACHE_TTL
+
+# errors about the file_id itself; anything else (a dead chat, bad markdown)
+# would fail the upload too, and must not evict an id other chats can use
+FILE_ID_ERRORS = (WrongFileIdentifier, WrongRemoteFileIdSpecified, TypeOfFileMismatch)
+
+
+def photo_key(photo) -> str:
+    """
+    Content hash of a photo given as a URL, bytes or a BytesIO.
+    """
+    if isinstance(photo, str):
+        data = photo.encode("utf-8")
+    elif isinstance(photo, BytesIO):
+        data = photo.getvalue()
+    else:
+        data = bytes(photo)
+    return hashlib.sha256(data).hexdigest()
+
+
+class PhotoSender:
+    """
+    Sends photos through Telegram's file_id when the same content was
+    uploaded before, skipping both the upload and Telegram's URL fetch.
+    """
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.file_ids = LRUCache(maxsize=FILE_ID_CACHE_SIZE, ttl=FILE_ID_CACHE_TTL)
+
+    async def send_photo(self, chat_id, photo, key: str = None, **kwargs):
+        key = key or photo_key(photo)
+        file_id = self.file_ids.get(key)
+        if file_id is not None:
+            try:
+                return await self.bot.send_photo(
+                    chat_id=chat_id, photo=file_id, **kwargs
+                )
+            except FILE_ID_ERRORS:
+                logging.warning("Cached file_id rejected, uploading again")
+                self.file_ids.pop(key)
+        message = await self.bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+        if message.photo:
+            self.file_ids.set(key, message.photo[-1].file_id)
+        return message
+
+    def stats(self):
+        return self.file_ids.stats()
@@ -0,0 +1,284 @@
+import functools
+import logging
+import time
+from io import BytesIO
+
+import aiohttp
+from PIL import Image, ImageDraw, ImageFont
+
+from config import (
+    HCTI_API_KEY,
+    HCTI_API_USER_ID,
+    HCTI_API_ENDPOINT,
+    IMAGE_FORMAT,
+    IMAGE_AUTO_FORMATS,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_WEBP_QUALITY,
+    IMAGE_PALETTE_COLORS,
+)
+from http_utils import http_client
+from resources import Resources, resources
+from limit_utils import hcti_limit
+from worker_utils import image_pool
+
+CARD_SIZE = (240, 300)
+CARD_BG_COLOR = (134, 185, 224)
+# rgba(255,255,255,0.8) from weather_icons.css blended over the background
+CARD_TEXT_COLOR = (231, 241, 249)
+ICON_SIZE = 100
+# icons are drawn at a larger scale and downsampled once to get smooth edges
+ICON_SCALE = 4
+
+SUN_COLOR = (255, 214, 50, 255)
+CLOUD_COLOR = (255, 255, 255, 255)
+RAIN_CLOUD_COLOR = (119, 153, 175, 255)
+SNOW_CLOUD_COLOR = (186, 206, 221, 255)
+PRECIPITATION_COLOR = (255, 255, 255, 255)
+
+# shipped with the code so cards look the same on every host
+FONT_PATH = "staticfiles/DejaVuSans.ttf"
+
+
+@functools.lru_cache(maxsize=None)
+def get_font(size: int):
+    return ImageFont.truetype(BytesIO(resources.read(FONT_PATH)), size)
+
+
+def _sun(draw, cx, cy, r):
+    ray = r * 0.35
+    for dx, dy in ((1, 0), (0, 1), (0.7, 0.7), (0.7, -0.7)):
+        draw.line(
+            (
+                cx - dx * (r + ray),
+                cy - dy * (r + ray),
+                cx + dx * (r + ray),
+                cy + dy * (r + ray),
+            ),
+            fill=SUN_COLOR,
+            width=int(r * 0.18),
+        )
+    draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=SUN_COLOR)
+
+
+def _cloud(draw, x, y, w, color):
+    h = w * 0.5
+    draw.ellipse((x, y + h * 0.35, x + w * 0.45, y + h), fill=color)
+    draw.ellipse((x + w * 0.2, y, x + w * 0.75, y + h * 0.9), fill=color)
+    draw.ellipse((x + w * 0.5, y + h * 0.25, x + w, y + h), fill=color)
+    draw.rectangle((x + w * 0.2, y + h * 0.6, x + w * 0.8, y + h), fill=color)
+
+
+def _drops(draw, x, y, w, count, length):
+    step = w / count
+    for i in range(count):
+        dx = x + step * (i + 0.5)
+        dy = y + (i % 2) * length * 0.6
+        draw.line(
+            (dx, dy, dx - length * 0.3, dy + length),
+            fill=PRECIPITATION_COLOR,
+            width=int(length * 0.25),
+        )
+
+
+def _flakes(draw, x, y, w, count, r):
+    step = w / count
+    for i in range(count):
+        cx = x + step * (i + 0.5)
+        cy = y + (i % 2) * r * 2.5 + r
+        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=PRECIPITATION_COLOR)
+
+
+def _bolt(draw, x, y, s):
+    draw.polygon(
+        (
+            (x + s * 0.5, y),
+            (x, y + s * 0.6),
+            (x + s * 0.4, y + s * 0.6),
+            (x + s * 0.2, y + s * 1.2),
+            (x + s * 0.8, y + s * 0.45),
+            (x + s * 0.4, y + s * 0.45),
+        ),
+        fill=SUN_COLOR,
+    )
+
+
+def _draw_icon(draw, icon, s):
+    if icon == "sunny":
+        _sun(draw, s / 2, s / 2, s * 0.25)
+    elif icon == "partlycloudy":
+        _sun(draw, s * 0.6, s * 0.35, s * 0.2)
+        _cloud(draw, s * 0.05, s * 0.45, s * 0.6, CLOUD_COLOR)
+    elif icon == "mostlycloudy":
+        _sun(draw, s * 0.65, s * 0.3, s * 0.17)
+        _cloud(draw, s * 0.05, s * 0.3, s * 0.85, CLOUD_COLOR)
+    elif icon == "cloudy":
+        _cloud(draw, s * 0.05, s * 0.25, s * 0.9, CLOUD_COLOR)
+    elif icon == "fogorhazy":
+        for i in range(4):
+            y = s * (0.3 + i * 0.14)
+            indent = s * 0.1 * (i % 2)
+            draw.line(
+                (s * 0.1 + indent, y, s * 0.9 - indent, y),
+                fill=CLOUD_COLOR,
+                width=int(s * 0.06),
+            )
+    elif icon == "chancerain":
+        _cloud(draw, s * 0.05, s * 0.1, s * 0.9, RAIN_CLOUD_COLOR)
+        _drops(draw, s * 0.15, s * 0.6, s * 0.7, 4, s * 0.2)
+    elif icon == "chancetstorms":
+        _cloud(draw, s * 0.05, s * 0.1, s * 0.9, RAIN_CLOUD_COLOR)
+        _bolt(draw, s * 0.38, s * 0.5, s * 0.35)
+    elif icon == "sleet":
+        _cloud(draw, s * 0.05, s * 0.1, s * 0.9, SNOW_CLOUD_COLOR)
+        _drops(draw, s * 0.15, s * 0.6, s * 0.35, 2, s * 0.2)
+        _flakes(draw, s * 0.5, s * 0.6, s * 0.35, 2, s * 0.05)
+    elif icon == "flurries":
+        _cloud(draw, s * 0.05, s * 0.1, s * 0.9, SNOW_CLOUD_COLOR)
+        _flakes(draw, s * 0.2, s * 0.6, s * 0.6, 3, s * 0.04)
+    elif icon == "snow":
+        _cloud(draw, s * 0.05, s * 0.1, s * 0.9, SNOW_CLOUD_COLOR)
+        _flakes(draw, s * 0.1, s * 0.6, s * 0.8, 5, s * 0.055)
+    else:
+        raise ValueError("Unknown weather icon: {}".format(icon))
+
+
+@functools.lru_cache(maxsize=None)
+def get_icon_sprite(icon: str) -> Image.Image:
+    """
+    Uses sprites/<icon>.png from the resource bundle if there is one,
+    otherwise draws the icon.
+    """
+    data = resources.find("sprites/{}.png".format(icon))
+    if data is not None:
+        return Image.open(BytesIO(data)).convert("RGBA")
+    size = ICON_SIZE * ICON_SCALE
+    sprite = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    _draw_icon(ImageDraw.Draw(sprite), icon, size)
+    return sprite.resize((ICON_SIZE, ICON_SIZE), Image.LANCZOS)
+
+
+def draw_card(icon: str, city: str, weather: str) -> Image.Image:
+    card = Image.new("RGB", CARD_SIZE, color=CARD_BG_COLOR)
+    draw = ImageDraw.Draw(card)
+    font = get_font(20)
+    width, height = CARD_SIZE
+
+    for text, y in ((city.upper(), height * 0.15), (weather.upper(), height * 0.75)):
+        left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+        draw.text(
+            ((width - (right - left)) / 2, y), text, font=font, fill=CARD_TEXT_COLOR
+        )
+
+    sprite = get_icon_sprite(icon)
+    card.paste(
+        sprite, ((width - ICON_SIZE) // 2, (height - ICON_SIZE) // 2 - 5), sprite
+    )
+    return card
+
+
+def _save_png8(img, bio):
+    # the cards are flat-coloured, so a small adaptive palette is lossless enough
+    img.quantize(colors=IMAGE_PALETTE_COLORS, method=Image.FASTOCTREE).save(
+        bio, "PNG", optimize=True
+    )
+
+
+def _save_jpeg(img, bio):
+    img.convert("RGB").save(
+        bio, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True
+    )
+
+
+# format -> (file extension, writer)
+ENCODERS = {
+    "png": ("png", lambda img, bio: img.save(bio, "PNG")),
+    "png-optimized": (
+        "png",
+        lambda img, bio: img.save(bio, "PNG", optimize=True, compress_level=9),
+    ),
+    "png8": ("png", _save_png8),
+    "jpeg": ("jpg", _save_jpeg),
+    "webp": (
+        "webp",
+        lambda img, bio: img.save(bio, "WEBP", quality=IMAGE_WEBP_QUALITY, method=4),
+    ),
+}
+
+
+def encode_image(img: Image.Image, fmt: str = IMAGE_FORMAT):
+    """
+    Encodes img with one of ENCODERS, or with every IMAGE_AUTO_FORMATS
+    candidate keeping the smallest when fmt is "auto".
+    Returns (bytes, extension).
+    """
+    candidates = IMAGE_AUTO_FORMATS.split(",") if fmt == "auto" else [fmt]
+    best = None
+    for name in candidates:
+        ext, save = ENCODERS[name.strip()]
+        start = time.perf_counter()
+        bio = BytesIO()
+        save(img, bio)
+        data = bio.getvalue()
+        logging.debug(
+            "Encoded %sx%s as %s: %d bytes in %.1f ms",
+            img.width,
+            img.height,
+            name,
+            len(data),
+            (time.perf_counter() - start) * 1000,
+        )
+        if best is None or len(data) < len(best[0]):
+            best = (data, ext)
+    return best
+
+
+def draw_card_png(icon: str, city: str, weather: str) -> bytes:
+    bio = BytesIO()
+    draw_card(icon, city, weather).save(bio, "PNG")
+    return bio.getvalue()
+
+
+class LocalRenderer:
+    """
+    Draws weather cards in-process from cached icon sprites and fonts.
+    """
+
+    name = "local"
+
+    async def render(self, icon: str, city: str, weather: str):
+        png = await image_pool.run(draw_card_png, icon, city, weather)
+        return {"url": None, "png": png}
+
+
+class HctiRenderer:
+    """
+    Renders templates/*.html with weather_icons.css through the HCTI API.
+    """
+
+    name = "hcti"
+
+    def __init__(self, resources: Resources):
+        self.resources = resources
+
+    def html(self, icon: str, city: str, weather: str) -> str:
+        return self.resources.template(icon).format(city=city, weath=weather)
+
+    async def render(self, icon: str, city: str, weather: str):
+        data = {
+            "html": self.html(icon, city, weather),
+            "css": self.resources.css(),
+            "google_fonts": "Roboto",
+        }
+        # Overloaded from hcti_limit propagates to the bot's errors handler
+        async with hcti_limit:
+            try:
+                r = await http_client.post_json(
+                    url=HCTI_API_ENDPOINT,
+                    data=data,
+                    auth=aiohttp.BasicAuth(HCTI_API_USER_ID, HCTI_API_KEY),
+                    upstream="hcti",
+                )
+                return {"url": r["url"], "png": None}
+            except Exception:
+                logging.exception("HCTI render failed")
+                return None
@@ -0,0 +1,124 @@
+import os
+import re
+import sys
+import zipfile
+from collections.abc import Mapping
+
+from config import RESOURCE_BUNDLE
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TEMPLATE_NAMES = (
+    "chancetstorms",
+    "chancerain",
+    "snow",
+    "sleet",
+    "flurries",
+    "fogorhazy",
+    "sunny",
+    "partlycloudy",
+    "mostlycloudy",
+    "cloudy",
+)
+CSS_PATH = "staticfiles/weather_icons.css"
+# directories packed by build_bundle; sprites/<icon>.png is optional
+BUNDLED_DIRS = ("templates", "staticfiles", "sprites")
+
+
+def minify_html(html: str) -> str:
+    """
+    Drops line breaks together with the indentation around them; the
+    templates only break lines between block elements.
+    """
+    return re.sub(r"\s*\n\s*", "", html).strip()
+
+
+class Templates(Mapping):
+    """
+    icon name -> minified HTML, read on first access.
+    """
+
+    def __init__(self, resources):
+        self.resources = resources
+
+    def __getitem__(self, name: str) -> str:
+        if name not in TEMPLATE_NAMES:
+            raise KeyError(name)
+        return self.resources.template(name)
+
+    def __iter__(self):
+        return iter(TEMPLATE_NAMES)
+
+    def __len__(self):
+        return len(TEMPLATE_NAMES)
+
+
+class Resources:
+    """
+    Static files read on first use and kept in memory, either from the
+    source tree (relative to this module, not the working directory) or
+    from a zip bundle with the same layout.
+    """
+
+    def __init__(self, bundle: str = None, base_dir: str = BASE_DIR):
+        self.bundle = bundle
+        self.base_dir = base_dir
+        self.templates = Templates(self)
+        self._zip = None
+        self._files = {}
+        self._templates = {}
+
+    def _read(self, path: str) -> bytes:
+        if self.bundle:
+            if self._zip is None:
+                self._zip = zipfile.ZipFile(self.bundle)
+            return self._zip.read(path)
+        with open(os.path.join(self.base_dir, path), "rb") as file:
+            return file.read()
+
+    def read(self, path: str) -> bytes:
+        data = self._files.get(path)
+        if data is None:
+            data = self._files[path] = self._read(path)
+        return data
+
+    def find(self, path: str):
+        """
+        Like read(), but returns None for a missing file.
+        """
+        try:
+            return self.read(path)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def text(self, path: str) -> str:
+        return self.read(path).decode("utf-8")
+
+    def template(self, name: str) -> str:
+        html = self._templates.get(name)
+        if html is None:
+            html = self._templates[name] = minify_html(
+                self.text("templates/{}.html".format(name))
+            )
+        return html
+
+    def css(self) -> str:
+        return self.text(CSS_PATH)
+
+
+def build_bundle(path: str, base_dir: str = BASE_DIR):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as bundle:
+        for directory in BUNDLED_DIRS:
+            root = os.path.join(base_dir, directory)
+            if not os.path.isdir(root):
+                continue
+            for name in sorted(os.listdir(root)):
+                bundle.write(os.path.join(root, name), directory + "/" + name)
+
+
+resources = Resources(RESOURCE_BUNDLE or None)
+
+
+if __name__ == "__main__":
+    # python resources.py bundle.zip
+    build_bundle(sys.argv[1])
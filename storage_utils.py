@@ -0,0 +1,236 @@
+import asyncio
+import json
+import logging
+import typing
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
+
+from config import (
+    FSM_STORAGE,
+    FSM_STATE_TTL,
+    FSM_PURGE_INTERVAL,
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_DB,
+    REDIS_PASSWORD,
+)
+from db_utils import Database
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM storage in the fsm_states table, sharing the Database pool.
+
+    State, data and bucket live in one row, so a read fetches all of them at
+    once; the row is reused for further reads within the same task (one
+    update), which turns the usual get_state + get_data pair into a single
+    query. Rows untouched for longer than ttl seconds count as abandoned and
+    are deleted every FSM_PURGE_INTERVAL seconds once start() is called.
+
+    The table is created by the fsm_states migration.
+    """
+
+    def __init__(self, db: Database, ttl: int = None):
+        self.db = db
+        self.ttl = ttl
+        self._rows = {}
+        self._task = None
+
+    def start(self):
+        if self.ttl and FSM_PURGE_INTERVAL and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.purge()
+            except Exception:
+                logging.exception("FSM state purge failed")
+            await asyncio.sleep(FSM_PURGE_INTERVAL)
+
+    async def purge(self):
+        if self.ttl:
+            await self.db.pool.execute(
+                "DELETE FROM fsm_states "
+                "WHERE updated_at < now() - make_interval(secs => $1)",
+                self.ttl,
+            )
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._rows.clear()
+
+    async def wait_closed(self):
+        pass
+
+    def _remember(self, address, row):
+        self._rows[address] = (asyncio.current_task(), row)
+
+    async def _row(self, chat, user):
+        address = self.check_address(chat=chat, user=user)
+        task, row = self._rows.get(address, (None, None))
+        if task is not None and task is asyncio.current_task():
+            return row
+        record = await self.db.pool.fetchrow(
+            'SELECT state, data, bucket FROM fsm_states WHERE chat = $1 AND "user" = $2'
+            " AND ($3::float8 IS NULL OR updated_at >= now() - make_interval(secs => $3))",
+            *map(int, address),
+            self.ttl,
+        )
+        if record is None:
+            row = {"state": None, "data": {}, "bucket": {}}
+        else:
+            row = {
+                "state": record["state"],
+                "data": json.loads(record["data"]),
+                "bucket": json.loads(record["bucket"]),
+            }
+        self._remember(address, row)
+        # forget rows of finished tasks so the dict stays bounded
+        if len(self._rows) > 1024:
+            self._rows = {k: v for k, v in self._rows.items() if not v[0].done()}
+        return row
+
+    async def _save(self, chat, user, **fields):
+        address = self.check_address(chat=chat, user=user)
+        row = dict(await self._row(*address))
+        row.update(fields)
+        await self.db.pool.execute(
+            'INSERT INTO fsm_states (chat, "user", state, data, bucket, updated_at) '
+            "VALUES ($1, $2, $3, $4, $5, now()) "
+            'ON CONFLICT (chat, "user") DO UPDATE SET '
+            "state = $3, data = $4, bucket = $5, updated_at = now()",
+            *map(int, address),
+            row["state"],
+            json.dumps(row["data"]),
+            json.dumps(row["bucket"]),
+        )
+        self._remember(address, row)
+
+    async def get_state(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        default: typing.Optional[str] = None,
+    ) -> typing.Optional[str]:
+        row = await self._row(chat, user)
+        return row["state"] or self.resolve_state(default)
+
+    async def get_data(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        default: typing.Optional[dict] = None,
+    ) -> typing.Dict:
+        row = await self._row(chat, user)
+        return dict(row["data"]) or dict(default or {})
+
+    async def set_state(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        state: typing.Optional[typing.AnyStr] = None,
+    ):
+        await self._save(chat, user, state=self.resolve_state(state))
+
+    async def set_data(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        data: typing.Dict = None,
+    ):
+        await self._save(chat, user, data=dict(data or {}))
+
+    async def update_data(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        data: typing.Dict = None,
+        **kwargs,
+    ):
+        new_data = await self.get_data(chat=chat, user=user)
+        new_data.update(data or {}, **kwargs)
+        await self._save(chat, user, data=new_data)
+
+    async def reset_state(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        with_data: typing.Optional[bool] = True,
+    ):
+        if with_data:
+            await self._save(chat, user, state=None, data={})
+        else:
+            await self._save(chat, user, state=None)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        default: typing.Optional[dict] = None,
+    ) -> typing.Dict:
+        row = await self._row(chat, user)
+        return dict(row["bucket"]) or dict(default or {})
+
+    async def set_bucket(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        bucket: typing.Dict = None,
+    ):
+        await self._save(chat, user, bucket=dict(bucket or {}))
+
+    async def update_bucket(
+        self,
+        *,
+        chat: typing.Union[str, int, None] = None,
+        user: typing.Union[str, int, None] = None,
+        bucket: typing.Dict = None,
+        **kwargs,
+    ):
+        new_bucket = await self.get_bucket(chat=chat, user=user)
+        new_bucket.update(bucket or {}, **kwargs)
+        await self._save(chat, user, bucket=new_bucket)
+
+
+def get_storage(db: Database) -> BaseStorage:
+    """
+    Builds the FSM storage selected by FSM_STORAGE: "memory", "redis" or
+    "postgres". Falls back to MemoryStorage if Redis support is missing.
+    """
+    if FSM_STORAGE == "postgres":
+        return PostgresStorage(db, ttl=FSM_STATE_TTL)
+    if FSM_STORAGE == "redis":
+        try:
+            from aiogram.contrib.fsm_storage.redis import RedisStorage2
+        except ImportError:
+            logging.warning("aioredis is not installed, using MemoryStorage")
+        else:
+            return RedisStorage2(
+                host=REDIS_HOST,
+                port=REDIS_PORT,
+                db=REDIS_DB,
+                password=REDIS_PASSWORD or None,
+                state_ttl=FSM_STATE_TTL,
+                data_ttl=FSM_STATE_TTL,
+                bucket_ttl=FSM_STATE_TTL,
+            )
+    return MemoryStorage()
@@ -0,0 +1,262 @@
+import datetime
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from bot_utils import WEATHER_UNITS, get_weather_card, card_photo, render_forecast
+from cache_utils import LRUCache, SingleFlight
+from config import FORECAST_CACHE_SIZE, FORECAST_CACHE_TTL, FORECAST_DEGRADED_TTL
+from limit_utils import forecast_limit
+from owm_utils import get_current_weather, get_onecall, quantize
+
+FORECAST_DAYS = 7
+FORECAST_BG_COLOR = (134, 185, 224)
+
+
+@dataclass
+class WeatherRequest:
+    lat: float
+    lon: float
+    # user setting: "celsius" or "fahrenheit"
+    units: str
+    # display name; defaults to the name OWM reports for the coordinates
+    city: Optional[str] = None
+
+
+@dataclass
+class CurrentWeatherResponse:
+    city: str
+    lat: float
+    lon: float
+    caption: str
+    # URL or BytesIO accepted by send_photo, plus its content key; both are
+    # None when no card could be rendered
+    photo: object
+    photo_key: Optional[str]
+
+
+@dataclass
+class DetailsResponse:
+    caption: str
+
+
+@dataclass
+class ForecastResponse:
+    photo: bytes
+    ext: str
+    caption: str
+    timezone: str
+    # days drawn as blank tiles because their card failed
+    placeholders: int = 0
+
+
+def wind_description(speed: float) -> str:
+    if speed <= 5:
+        return "(Gentle breeze)"
+    elif speed <= 8:
+        return "(Moderate breeze)"
+    elif speed <= 11:
+        return "(Fresh breeze)"
+    return "*Strong breeze*"
+
+
+def alerts_caption(alerts) -> str:
+    if not alerts:
+        return ""
+    lines = ""
+    for alert in alerts:
+        start = datetime.datetime.fromtimestamp(int(alert.start))
+        end = datetime.datetime.fromtimestamp(int(alert.end))
+        lines = lines + "{start} - {end}:\n {description}\n".format(
+            start=f"{start:%m-%d %H:%M:%S}",
+            end=f"{end:%m-%d %H:%M:%S}",
+            description=alert.description.replace("*", "\\*"),
+        )
+    return "*National alerts*:\n" + lines
+
+
+class WeatherService:
+    """
+    The single fetch -> render -> caption path for every weather product.
+    Handlers only deal with Telegram; caching, pooling and instrumentation
+    hang off this class so they apply to all of them.
+
+    Hooks are called as hook(product, seconds, error) after every call.
+    """
+
+    def __init__(self):
+        self.hooks: List[Callable] = []
+        # forecast_key -> (ForecastResponse, warmed); warmed entries were
+        # pre-rendered by ForecastWarmer
+        self.forecasts = LRUCache(maxsize=FORECAST_CACHE_SIZE, ttl=FORECAST_CACHE_TTL)
+        self.forecast_requests = 0
+        self.warm_hits = 0
+        # concurrent misses for one forecast_key share a single render
+        self.forecast_flight = SingleFlight()
+
+    def add_hook(self, hook: Callable):
+        self.hooks.append(hook)
+
+    @asynccontextmanager
+    async def _instrument(self, product: str):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in self.hooks:
+                try:
+                    hook(product, elapsed, error)
+                except Exception:
+                    logging.exception("Weather service hook failed")
+
+    async def current(self, request: WeatherRequest) -> CurrentWeatherResponse:
+        async with self._instrument("current"):
+            units, sign = WEATHER_UNITS[request.units]
+            r = await get_current_weather(lat=request.lat, lon=request.lon, units=units)
+            city = request.city or r.name
+            card = await get_weather_card(
+                city, str(round(r.temp)), str(r.weather_id), sign
+            )
+            caption = (
+                "Current temp in {city} is {degrees:.0f} {metric} \n"
+                "*{description}*\n"
+                "Feels like {feels} {metric}".format(
+                    city=city,
+                    degrees=r.temp,
+                    metric=sign,
+                    description=r.description.capitalize(),
+                    feels=round(r.feels_like),
+                )
+            )
+            return CurrentWeatherResponse(
+                city=city,
+                lat=request.lat if request.city else r.lat,
+                lon=request.lon if request.city else r.lon,
+                caption=caption,
+                photo=card and card_photo(card),
+                photo_key=card and card["key"],
+            )
+
+    async def details(self, request: WeatherRequest) -> DetailsResponse:
+        async with self._instrument("details"):
+            units, sign = WEATHER_UNITS[request.units]
+            r = await get_onecall(
+                lat=request.lat,
+                lon=request.lon,
+                units=units,
+                parts=("current",),
+            )
+            current = r.current
+            if current.uvi > 2:
+                uvi_description = "*UV index is heightended*"
+            else:
+                uvi_description = ""
+
+            brief = (
+                "Current temp in {city} is {degrees:.0f} {metric} \n"
+                "*{description}*\n"
+                "Feels like {feels} {metric}".format(
+                    city=request.city,
+                    degrees=current.temp,
+                    metric=sign,
+                    description=current.description.capitalize(),
+                    feels=current.feels_like,
+                )
+            )
+            details = (
+                "\nPressure: {pressure} hPa\n"
+                "Humidity: {humidity}%\n"
+                "UV index: {uvi} {uvi_description}\n"
+                "Wind speed: {wind_speed}m/s {wind_speed_description}".format(
+                    pressure=current.pressure,
+                    humidity=current.humidity,
+                    uvi=current.uvi,
+                    uvi_description=uvi_description,
+                    wind_speed=current.wind_speed,
+                    wind_speed_description=wind_description(current.wind_speed),
+                )
+            )
+            return DetailsResponse(caption=brief + details)
+
+    @staticmethod
+    def forecast_key(request: WeatherRequest):
+        return (
+            quantize(request.lat),
+            quantize(request.lon),
+            request.units,
+            datetime.date.today(),
+        )
+
+    @property
+    def renders_saved(self) -> int:
+        """
+        Forecast renders avoided by joining one already in flight.
+        """
+        return self.forecast_flight.shared
+
+    def warm_hit_ratio(self) -> float:
+        if not self.forecast_requests:
+            return 0.0
+        return self.warm_hits / self.forecast_requests
+
+    async def forecast(
+        self, request: WeatherRequest, warm: bool = False, count: bool = True
+    ) -> ForecastResponse:
+        """
+        Serves the strip from the forecast cache when possible. warm=True
+        always renders and marks the cached entry as pre-computed.
+        count=False keeps background callers out of warm_hit_ratio.
+        Identical requests arriving during a render wait for its result.
+        """
+        key = self.forecast_key(request)
+        if not warm:
+            if count:
+                self.forecast_requests += 1
+            cached = self.forecasts.get(key, count=count)
+            if cached is not None:
+                response, warmed = cached
+                if warmed and count:
+                    self.warm_hits += 1
+                return response
+
+        async def render():
+            response = await self._render_forecast(request)
+            if response.placeholders:
+                # retry the missing days soon instead of serving blanks all hour
+                self.forecasts.set(key, (response, False), ttl=FORECAST_DEGRADED_TTL)
+            else:
+                self.forecasts.set(key, (response, warm))
+            return response
+
+        return await self.forecast_flight.do(key, render)
+
+    async def _render_forecast(self, request: WeatherRequest) -> ForecastResponse:
+        async with self._instrument("forecast"):
+            units, sign = WEATHER_UNITS[request.units]
+            r = await get_onecall(
+                lat=request.lat,
+                lon=request.lon,
+                units=units,
+                parts=("daily", "alerts"),
+            )
+            async with forecast_limit:
+                photo, ext, placeholders = await render_forecast(
+                    r.daily[:FORECAST_DAYS], sign, bg_color=FORECAST_BG_COLOR
+                )
+            return ForecastResponse(
+                photo=photo,
+                ext=ext,
+                caption=alerts_caption(r.alerts),
+                timezone=r.timezone,
+                placeholders=placeholders,
+            )
+
+
+weather_service = WeatherService()
@@ -0,0 +1,50 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import IMAGE_POOL_KIND, IMAGE_POOL_WORKERS, IMAGE_POOL_QUEUE
+
+
+class WorkerPool:
+    """
+    Runs CPU-bound work (PIL decode, composition, encoding) off the event
+    loop in a thread or process pool. At most workers + queue_size jobs are
+    submitted at once; further callers wait, which gives backpressure
+    instead of an unbounded executor queue.
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = None, queue_size: int = 0):
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self._executor = None
+        self._slots = None
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="image"
+                )
+        return self._executor
+
+    async def run(self, func, *args, **kwargs):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers + self.queue_size)
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            return await loop.run_in_executor(
+                self.executor, functools.partial(func, *args, **kwargs)
+            )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_pool = WorkerPool(IMAGE_POOL_KIND, IMAGE_POOL_WORKERS, IMAGE_POOL_QUEUE)